@@ -0,0 +1,133 @@
+# ==============================================================================
+# СЕРИИ И УРОВНИ
+# ==============================================================================
+# api_read и api_buy дописывают события в activity_events в той же
+# транзакции, что и само прочтение или покупку. Периодическая задача
+# (flask --app app activity-rollup, по крону) переносит их в users.streak
+# и users.last_active несколькими запросами над множествами: без циклов по
+# игрокам в Python. users.level пишется вместе с XP, задача лишь выравнивает
+# строки, где он разошёлся (например, после смены LEVEL_XP). События берутся после отметки из
+# job_watermarks и до самого нового, которому уже не меньше lag секунд:
+# id выдаются до COMMIT, и более свежее событие с меньшим id могло ещё не
+# стать видимым. Дни считаются по часам БД.
+
+# Серия по событиям после отметки. Дни каждого игрока (только позже его
+# last_active) разбиваются на острова подряд идущих дат (дата минус номер
+# по порядку постоянна внутри острова); последний остров продолжает
+# прежнюю серию, если начинается сразу после last_active.
+_STREAK = {
+    'postgres': """
+        UPDATE users SET
+            streak = CASE WHEN users.last_active = r.first_day - 1 THEN users.streak + r.len ELSE r.len END,
+            last_active = r.last_day
+        FROM (
+            WITH days AS (
+                SELECT DISTINCT user_id, CAST(created_at AS DATE) AS day
+                FROM activity_events WHERE id > %s AND id <= %s
+            ), fresh AS (
+                SELECT d.user_id, d.day,
+                       d.day - CAST(row_number() OVER (PARTITION BY d.user_id ORDER BY d.day) AS INTEGER) AS grp
+                FROM days d JOIN users u ON u.id = d.user_id
+                WHERE u.last_active IS NULL OR d.day > u.last_active
+            ), runs AS (
+                SELECT user_id, day, grp, max(grp) OVER (PARTITION BY user_id) AS last_grp FROM fresh
+            )
+            SELECT user_id, min(day) AS first_day, max(day) AS last_day, count(*) AS len
+            FROM runs WHERE grp = last_grp GROUP BY user_id
+        ) r
+        WHERE users.id = r.user_id""",
+    'sqlite': """
+        UPDATE users SET
+            streak = CASE WHEN users.last_active = date(r.first_day, '-1 day')
+                          THEN users.streak + r.len ELSE r.len END,
+            last_active = r.last_day
+        FROM (
+            WITH days AS (
+                SELECT DISTINCT user_id, date(created_at) AS day
+                FROM activity_events WHERE id > ? AND id <= ?
+            ), fresh AS (
+                SELECT d.user_id, d.day,
+                       julianday(d.day) - row_number() OVER (PARTITION BY d.user_id ORDER BY d.day) AS grp
+                FROM days d JOIN users u ON u.id = d.user_id
+                WHERE u.last_active IS NULL OR d.day > u.last_active
+            ), runs AS (
+                SELECT user_id, day, grp, max(grp) OVER (PARTITION BY user_id) AS last_grp FROM fresh
+            )
+            SELECT user_id, min(day) AS first_day, max(day) AS last_day, count(*) AS len
+            FROM runs WHERE grp = last_grp GROUP BY user_id
+        ) r
+        WHERE users.id = r.user_id""",
+}
+
+# Конец пачки: batch_size-е событие после отметки, которому уже не меньше
+# lag секунд (или последнее такое, если их меньше). Считаются строки, а не
+# диапазон id: после дыры в последовательности пачка всё равно не пуста.
+_UPPER = {
+    'postgres': """SELECT max(id) FROM (
+                       SELECT id FROM activity_events
+                       WHERE id > %s AND created_at <= LOCALTIMESTAMP - %s * INTERVAL '1 second'
+                       ORDER BY id LIMIT %s
+                   ) b""",
+    'sqlite': """SELECT max(id) FROM (
+                     SELECT id FROM activity_events
+                     WHERE id > ? AND created_at <= datetime('now', '-' || ? || ' seconds')
+                     ORDER BY id LIMIT ?
+                 ) b""",
+}
+
+# Серия прервана: последний активный день раньше вчерашнего
+_RESET = {
+    'postgres': "UPDATE users SET streak = 0 WHERE streak > 0 AND last_active < CURRENT_DATE - 1",
+    'sqlite': "UPDATE users SET streak = 0 WHERE streak > 0 AND last_active < date('now', '-1 day')",
+}
+
+# Сериализует параллельные запуски на PostgreSQL
+_PG_LOCK_ID = 727101
+WATERMARK = 'activity_rollup'
+
+
+def rollup(cur, is_pg, level_xp, lag=10, batch_size=1_000_000, log=print):
+    """Переносит новые события в серии и уровни; возвращает словарь счётчиков.
+
+    cur — курсор соединения в autocommit (PostgreSQL) или вне транзакции (SQLite).
+    """
+    dialect = 'postgres' if is_pg else 'sqlite'
+    ph = '%s' if is_pg else '?'
+    stats = {'watermark': None, 'streaks': 0, 'reset': 0, 'levels': 0}
+    while True:
+        cur.execute("BEGIN" if is_pg else "BEGIN IMMEDIATE")
+        try:
+            if is_pg:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (_PG_LOCK_ID,))
+            cur.execute(f"SELECT watermark FROM job_watermarks WHERE name = {ph}", (WATERMARK,))
+            low = stats['watermark'] = cur.fetchone()[0]
+            cur.execute(_UPPER[dialect], (low, lag, batch_size))
+            high = cur.fetchone()[0]
+            if high is None:
+                cur.execute("ROLLBACK")
+                break
+            cur.execute(_STREAK[dialect], (low, high))
+            stats['streaks'] += cur.rowcount
+            cur.execute(f"UPDATE job_watermarks SET watermark = {ph} WHERE name = {ph}", (high, WATERMARK))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        stats['watermark'] = high
+        if log:
+            log(f"🔥 События до #{high:,}: серий обновлено {stats['streaks']:,}")
+
+    # Отдельно от пачек: сброс зависит от даты, а не от новых событий, а
+    # уровень — от XP, а не от журнала. Оба запроса меняют только
+    # отличающиеся строки.
+    cur.execute("BEGIN" if is_pg else "BEGIN IMMEDIATE")
+    try:
+        cur.execute(_RESET[dialect])
+        stats['reset'] = cur.rowcount
+        cur.execute(f"UPDATE users SET level = 1 + xp / {ph} WHERE level <> 1 + xp / {ph}", (level_xp, level_xp))
+        stats['levels'] = cur.rowcount
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    return stats
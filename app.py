@@ -1,189 +1,616 @@
 import os
-import json
-import hmac
 import hashlib
-import urllib.parse
+import hmac
+import io
+import cProfile
+import pstats
+import time
 import sqlite3
-from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify, g
+import threading
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, abort, make_response, Response
+from flask import before_render_template, template_rendered
+from markupsafe import Markup
 from functools import wraps
+import click
+from db_pool import ConnectionPool, PoolTimeout
+from sqlite_engine import SQLiteEngine
+from leaderboard import Leaderboard
+from rewards import RewardBuffer
+from telegram_auth import TelegramAuth
+import migrations
+import importer
+import activity
+from repository import Repository, User, make_pg_connection_class, BUY_OK, BUY_NOT_FOUND, BUY_OWNED, BUY_NO_FUNDS
+from metrics import Metrics, TimedCursor
+from http_cache import CatalogVersions, FragmentCache, file_fingerprint, tree_fingerprint, make_etag
 
 # ==============================================================================
 # КОНФИГУРАЦИЯ
 # ==============================================================================
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-prod')
-    BOT_TOKEN = "8534219584:AAHW2T8MTmoR3dJN_bQDtru49lUSx401QqA"
+    BOT_TOKEN = os.environ.get('BOT_TOKEN', "8534219584:AAHW2T8MTmoR3dJN_bQDtru49lUSx401QqA")
+    # Сколько секунд initData считается свежим (защита от повторного использования)
+    AUTH_MAX_AGE = int(os.environ.get('AUTH_MAX_AGE', 86400))
     # Render предоставляет DATABASE_URL. Если его нет, используем SQLite для теста.
     DATABASE_URL = os.environ.get('DATABASE_URL')
+    # Пул соединений PostgreSQL (на каждый воркер gunicorn)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+    # Сколько секунд ждать установки нового соединения с PostgreSQL
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+    # Серверные prepared statements; выключите за pgbouncer в режиме transaction
+    DB_SERVER_PREPARE = os.environ.get('DB_SERVER_PREPARE', '1') == '1'
+    # ASYNC_MODE=gevent: воркеры gunicorn на gevent (см. gunicorn.conf.py).
+    # Тысячи одновременных запросов делят DB_POOL_MAX соединений воркера,
+    # независимые запросы обработчика идут параллельно (gather)
+    ASYNC_MODE = os.environ.get('ASYNC_MODE', '')
+    # SQLite (без DATABASE_URL): постоянные соединения по потокам, WAL и прагмы.
+    # SQLITE_ENGINE=0 возвращает прежнее соединение на каждый запрос.
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'habitmaster.db')
+    # Под gevent вызовы SQLite всё равно блокируют воркер, а потоковые соединения
+    # стали бы соединениями гринлетов, поэтому там остаётся соединение на запрос
+    SQLITE_ENGINE = os.environ.get('SQLITE_ENGINE', '1') == '1' and not ASYNC_MODE
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))
+    # Сколько секунд живёт закэшированный топ-10 в /stats
+    LEADERBOARD_TTL = float(os.environ.get('LEADERBOARD_TTL', 10))
+    # Раз во сколько секунд распределение XP для места в /stats сверяется с БД
+    LEADERBOARD_RANK_SYNC = float(os.environ.get('LEADERBOARD_RANK_SYNC', 60))
+    # Отложенное начисление наград за чтение: копим в памяти и пишем пачками
+    REWARDS_WRITE_BEHIND = os.environ.get('REWARDS_WRITE_BEHIND', '') == '1'
+    REWARDS_FLUSH_INTERVAL = float(os.environ.get('REWARDS_FLUSH_INTERVAL', 2))
+    REWARDS_FLUSH_SIZE = int(os.environ.get('REWARDS_FLUSH_SIZE', 500))
+    # Статей на одной странице библиотеки
+    LIBRARY_PAGE_SIZE = int(os.environ.get('LIBRARY_PAGE_SIZE', 30))
+    # Результатов поиска на одной странице /api/search
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    # Как долго воркер доверяет закэшированной версии каталога статей/товаров
+    CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 5))
+    # Запросы к БД дольше порога попадают в лог и /metrics
+    METRICS_SLOW_QUERY_MS = float(os.environ.get('METRICS_SLOW_QUERY_MS', 100))
+    # Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # Если задан, запрос с заголовком X-Profile: <токен> профилируется cProfile
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+leaderboard = Leaderboard(size=10, ttl=app.config['LEADERBOARD_TTL'], sync_interval=app.config['LEADERBOARD_RANK_SYNC'])
+catalog = CatalogVersions(ttl=app.config['CATALOG_VERSION_TTL'])
+fragments = FragmentCache()
+telegram_auth = TelegramAuth(app.config['BOT_TOKEN'], max_age=app.config['AUTH_MAX_AGE'])
+metrics = Metrics(slow_query=app.config['METRICS_SLOW_QUERY_MS'] / 1000)
+
+# ==============================================================================
+# ШАБЛОНЫ
+# ==============================================================================
+# Реестр страниц: компилируются один раз при импорте и живут в кэше Jinja,
+# так что рендер страницы — это поиск в кэше плюс вызов render().
+TEMPLATES = ('base.html', 'home.html', 'library.html', '_library_nav.html', 'shop.html', 'stats.html', 'profile.html')
+
+def warm_templates():
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
+
+warm_templates()
+
+# ==============================================================================
+# HTTP-КЭШ
+# ==============================================================================
+# Статика раздаётся по адресам с отпечатком содержимого (?v=...) и кэшируется
+# навсегда; HTML страниц каталога получает ETag и отвечает 304 без рендера.
+ASSET_VERSION = tree_fingerprint(os.path.join(app.root_path, app.template_folder), app.static_folder)
+
+_static_versions = {}
+
+def static_url(filename):
+    v = _static_versions.get(filename)
+    if v is None:
+        v = _static_versions[filename] = file_fingerprint(os.path.join(app.static_folder, filename))
+    return url_for('static', filename=filename, v=v)
+
+app.jinja_env.globals['static_url'] = static_url
+
+@app.after_request
+def static_cache_headers(resp):
+    if request.endpoint == 'static' and request.args.get('v') and resp.status_code == 200:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 31536000
+        resp.cache_control.immutable = True
+    return resp
+
+def page_etag(*parts):
+    return make_etag(ASSET_VERSION, request.full_path, *parts)
+
+def not_modified(etag):
+    # Ответ 304, если у клиента уже есть эта версия страницы
+    if etag in request.if_none_match:
+        return cacheable(app.response_class(status=304), etag)
+    return None
+
+def cacheable(resp, etag):
+    resp = make_response(resp)
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+# ==============================================================================
+# МЕТРИКИ И ПРОФИЛИРОВАНИЕ
+# ==============================================================================
+# На каждый запрос: время, число запросов к БД и их суммарное время (курсор
+# get_db() обёрнут в TimedCursor), время рендера шаблонов. Всё это отдаёт
+# /metrics в текстовом формате Prometheus, а браузеру — Server-Timing.
+def request_stats():
+    # Вне HTTP-запроса (CLI, фоновый сброс наград) — отдельная запись
+    if 'stats' not in g:
+        g.stats = metrics.request('background')
+    return g.stats
+
+@app.before_request
+def start_request_metrics():
+    g.stats = metrics.request(request.endpoint or 'unknown')
+    token = app.config['PROFILE_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('X-Profile', ''), token):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_metrics(resp):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        print(f"🔬 Профиль {request.method} {request.full_path}\n{out.getvalue()}")
+    stats = g.get('stats')
+    if stats is not None:
+        elapsed = metrics.finish(stats, resp.status_code)
+        resp.headers['Server-Timing'] = (f"db;desc=\"{stats.queries} queries\";dur={stats.db_time * 1000:.1f}, "
+                                         f"total;dur={elapsed * 1000:.1f}")
+    return resp
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    if 'stats' in g:
+        g.stats.render_started.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    if 'stats' in g and g.stats.render_started:
+        metrics.rendered(template.name, time.perf_counter() - g.stats.render_started.pop())
+
+def _pool_gauge():
+    if not app.config['DATABASE_URL']:
+        return {}
+    return {(k,): v for k, v in get_pool().stats().items() if k != 'max'}
+
+def _rewards_gauge():
+    buffer = _rewards if _rewards_pid == os.getpid() else None
+    if buffer is None:
+        return {}
+    return {('flushes',): buffer.flushes, ('flushed_rows',): buffer.flushed_rows, ('errors',): buffer.errors}
+
+metrics.gauge('db_pool', 'Пул соединений PostgreSQL этого воркера', _pool_gauge, ('stat',))
+metrics.gauge('fragment_cache', 'Кэш фрагментов: попадания и промахи',
+              lambda: {('hits',): fragments.hits, ('misses',): fragments.misses}, ('stat',))
+metrics.gauge('reward_buffer', 'Отложенная запись наград', _rewards_gauge, ('stat',))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return Response(metrics.render_text(), mimetype='text/plain; version=0.0.4')
+
 # ==============================================================================
 # РАБОТА С БАЗОЙ ДАННЫХ
 # ==============================================================================
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _pg_connect():
+    import psycopg2
+    factory = make_pg_connection_class() if app.config['DB_SERVER_PREPARE'] else None
+    conn = psycopg2.connect(app.config['DATABASE_URL'], connection_factory=factory,
+                            connect_timeout=app.config['DB_CONNECT_TIMEOUT'])
+    conn.autocommit = True
+    return conn
+
+def _pg_check(conn):
+    if conn.closed:
+        return False
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    return True
+
+def get_pool():
+    # Пул создаётся лениво и заново после fork, чтобы воркеры не делили сокеты.
+    # Конструктор открывает соединения (под gevent — с переключением гринлетов),
+    # поэтому создание под блокировкой: иначе два запроса построят по пулу
+    # и вернут соединения не в тот, из которого взяли
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    _pg_connect,
+                    minconn=app.config['DB_POOL_MIN'],
+                    maxconn=app.config['DB_POOL_MAX'],
+                    timeout=app.config['DB_POOL_TIMEOUT'],
+                    check=_pg_check,
+                    check_after=app.config['DB_POOL_CHECK_AFTER'],
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+_sqlite = None
+
+def get_sqlite():
+    global _sqlite
+    if _sqlite is None:
+        _sqlite = SQLiteEngine(
+            app.config['SQLITE_PATH'],
+            busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+            mmap_size=app.config['SQLITE_MMAP_SIZE'],
+            cache_size=app.config['SQLITE_CACHE_SIZE'],
+        )
+    return _sqlite
+
+def read_only(f):
+    # Маршрут только читает: на SQLite он идёт через отдельное соединение с
+    # query_only и в WAL не ждёт пишущие запросы
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.db_readonly = True
+        return f(*args, **kwargs)
+    return decorated
+
 def get_db():
     if not hasattr(g, 'db_conn'):
         if app.config['DATABASE_URL']:
-            # Подключение к PostgreSQL на Render
-            import psycopg2
-            g.db_conn = psycopg2.connect(app.config['DATABASE_URL'])
-            g.db_conn.autocommit = True
+            # Подключение к PostgreSQL на Render (из пула)
+            g.db_conn = get_pool().getconn()
             g.is_postgres = True
-            g.cursor = g.db_conn.cursor()
+        elif app.config['SQLITE_ENGINE']:
+            # Постоянное соединение SQLite этого потока
+            g.db_conn = get_sqlite().connection(readonly=g.get('db_readonly', False))
+            g.is_postgres = False
         else:
-            # Подключение к SQLite локально (для тестов)
-            g.db_conn = sqlite3.connect('habitmaster.db')
-            g.db_conn.row_factory = sqlite3.Row
+            # Отдельное соединение SQLite на запрос (для тестов)
+            g.db_conn = sqlite3.connect(app.config['SQLITE_PATH'])
             g.is_postgres = False
-            g.cursor = g.db_conn.cursor()
+        g.cursor = TimedCursor(g.db_conn.cursor(), request_stats())
     return g.cursor
 
+def get_repo():
+    if not hasattr(g, 'repo'):
+        get_db()
+        g.repo = Repository(g.db_conn, g.is_postgres, cursor=g.cursor)
+    return g.repo
+
+def gather(*calls):
+    # Независимые запросы одного обработчика: calls — функции от Repository.
+    # Первый идёт на соединении запроса; под gevent с PostgreSQL остальные
+    # выполняются одновременно в своих гринлетах на свободных соединениях
+    # пула. Ждать пул нельзя (запрос уже держит соединение — при нехватке
+    # все встали бы друг за другом), поэтому без свободного соединения
+    # запрос идёт по очереди на соединении запроса.
+    repo = get_repo()
+    if not (app.config['ASYNC_MODE'] == 'gevent' and app.config['DATABASE_URL']):
+        return [call(repo) for call in calls]
+    import gevent
+    pool = get_pool()
+    stats = request_stats()
+
+    def run(call, conn):
+        other = Repository(conn, True, cursor=TimedCursor(conn.cursor(), stats))
+        try:
+            return call(other)
+        finally:
+            other.close()
+            pool.putconn(conn, discard=bool(conn.closed))
+
+    results = [None] * len(calls)
+    jobs, inline = {}, [0]
+    for i, call in enumerate(calls[1:], 1):
+        conn = pool.getconn(wait=False)
+        if conn is None:
+            inline.append(i)
+        else:
+            jobs[i] = gevent.spawn(run, call, conn)
+    for i in inline:
+        results[i] = calls[i](repo)
+    gevent.joinall(list(jobs.values()), raise_error=True)
+    for i, job in jobs.items():
+        results[i] = job.value
+    return results
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db_conn = getattr(g, 'db_conn', None)
-    if db_conn and not getattr(g, 'is_postgres', False):
-        db_conn.close()
+    db_conn = g.pop('db_conn', None)
+    if db_conn is None:
+        return
+    if not g.pop('is_postgres', False):
+        g.cursor.close()
+        if app.config['SQLITE_ENGINE']:
+            get_sqlite().release(db_conn)
+        else:
+            db_conn.close()
+        return
+    import psycopg2.extensions
+    discard = bool(db_conn.closed)
+    if not discard:
+        try:
+            g.cursor.close()
+            # Незавершённая транзакция не должна вернуться в пул
+            if db_conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                db_conn.rollback()
+        except Exception:
+            discard = True
+    get_pool().putconn(db_conn, discard=discard)
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(e):
+    print(f"Pool Error: {e}")
+    resp = jsonify({'ok': False, 'error': 'Сервер перегружен, попробуйте позже'})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '1'
+    return resp
 
-def init_db():
+def init_db(target=None, seed=True):
     cur = get_db()
     is_pg = getattr(g, 'is_postgres', False)
     
     try:
-        # Создание таблиц
-        if is_pg:
-            cur.execute("""CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY, telegram_id TEXT UNIQUE, username TEXT, 
-                first_name TEXT, photo_url TEXT, balance INTEGER DEFAULT 100, 
-                xp INTEGER DEFAULT 0, level INTEGER DEFAULT 1, streak INTEGER DEFAULT 0
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS articles (
-                id SERIAL PRIMARY KEY, title TEXT, category TEXT, content TEXT, 
-                read_time TEXT, tags TEXT
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS user_reads (
-                user_id INTEGER, article_id INTEGER, is_read BOOLEAN DEFAULT FALSE, 
-                PRIMARY KEY (user_id, article_id)
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS products (
-                id SERIAL PRIMARY KEY, name TEXT, price INTEGER, icon TEXT, desc TEXT, type TEXT
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS purchases (
-                user_id INTEGER, product_id INTEGER, PRIMARY KEY (user_id, product_id)
-            )""")
-        else:
-            cur.execute("""CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id TEXT UNIQUE, username TEXT, 
-                first_name TEXT, photo_url TEXT, balance INTEGER DEFAULT 100, 
-                xp INTEGER DEFAULT 0, level INTEGER DEFAULT 1, streak INTEGER DEFAULT 0
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS articles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, category TEXT, content TEXT, 
-                read_time TEXT, tags TEXT
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS user_reads (
-                user_id INTEGER, article_id INTEGER, is_read BOOLEAN DEFAULT 0, 
-                PRIMARY KEY (user_id, article_id)
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, price INTEGER, icon TEXT, desc TEXT, type TEXT
-            )""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS purchases (
-                user_id INTEGER, product_id INTEGER, PRIMARY KEY (user_id, product_id)
-            )""")
-
+        # Схема — только миграциями; сюда попадаем из db-upgrade, не из воркера
+        migrations.upgrade(cur, is_pg, target=target)
+        if not seed:
+            return
+        
         # Заполнение данными (только если пусто)
         cur.execute("SELECT count(*) FROM articles")
         count = cur.fetchone()[0]
         
         if count == 0:
             print("📚 Загрузка демо-контента...")
-            # Добавляем несколько коротких статей для теста
+            # Тем же путём, что и import-content: повторный импорт их обновит
             demos = [
-                ("Энергия", "Батарейка: почему без энергии не работают техники", "Сон, еда, вода — база. Без энергии ты не сможешь ничего.", "5 мин", "База"),
-                ("Привычки", "Система Минимума", "Делай смехотворно мало, но каждый день. 1 отжимание лучше 0.", "4 мин", "Система"),
-                ("Дофамин", "Дофаминовая яма", "Телефон убивает мотивацию. Устрой детокс на 72 часа.", "6 мин", "Психология")
+                ("energy-battery", "Батарейка: почему без энергии не работают техники", "Энергия", "Сон, еда, вода — база. Без энергии ты не сможешь ничего.", "5 мин", "База"),
+                ("minimum-system", "Система Минимума", "Привычки", "Делай смехотворно мало, но каждый день. 1 отжимание лучше 0.", "4 мин", "Система"),
+                ("dopamine-pit", "Дофаминовая яма", "Дофамин", "Телефон убивает мотивацию. Устрой детокс на 72 часа.", "6 мин", "Психология")
             ]
-            for cat, title, content, time, tags in demos:
-                if is_pg:
-                    cur.execute("INSERT INTO articles (category, title, content, read_time, tags) VALUES (%s, %s, %s, %s, %s)", (cat, title, content, time, tags))
-                else:
-                    cur.execute("INSERT INTO articles (category, title, content, read_time, tags) VALUES (?, ?, ?, ?, ?)", (cat, title, content, time, tags))
+            importer.import_rows(g.db_conn, is_pg, 'articles', demos, log=None)
             
             # Товары
             prods = [
-                ("Защита серии", 500, "🛡️", "Сохраняет серию", "booster"),
-                ("XP Бустер", 300, "⚡", "x2 опыта", "booster"),
-                ("Набор мотивации", 200, "🔥", "+100 монет", "lootbox")
+                ("streak-shield", "Защита серии", 500, "🛡️", "Сохраняет серию", "booster"),
+                ("xp-booster", "XP Бустер", 300, "⚡", "x2 опыта", "booster"),
+                ("motivation-pack", "Набор мотивации", 200, "🔥", "+100 монет", "lootbox")
             ]
-            for name, price, icon, desc, type_ in prods:
-                if is_pg:
-                    cur.execute("INSERT INTO products (name, price, icon, desc, type) VALUES (%s, %s, %s, %s, %s)", (name, price, icon, desc, type_))
-                else:
-                    cur.execute("INSERT INTO products (name, price, icon, desc, type) VALUES (?, ?, ?, ?, ?)", (name, price, icon, desc, type_))
+            importer.import_rows(g.db_conn, is_pg, 'products', prods, log=None)
             
-            if not is_pg: g.db_conn.commit()
             print("✅ База готова!")
     except Exception as e:
         print(f"❌ Ошибка БД: {e}")
         if not is_pg: g.db_conn.rollback()
         raise e  # Важно: выбрасываем ошибку, чтобы Render показал её в логах
 
+@app.cli.command('db-upgrade')
+@click.option('--target', type=int, default=None, help='Остановиться на этой версии схемы')
+@click.option('--seed/--no-seed', default=True, show_default=True, help='Демо-контент в пустую базу')
+def db_upgrade(target, seed):
+    """Применяет миграции схемы. Запускается один раз при деплое (release в Procfile)."""
+    init_db(target=target, seed=seed and target is None)
+    current = max(migrations.applied_versions(get_db()), default=0)
+    print(f"✅ Схема БД: версия {current} из {migrations.latest_version()}")
+
+@app.cli.command('import-content')
+@click.argument('kind', type=click.Choice(sorted(importer.FIELDS)))
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--format', 'fmt', type=click.Choice(sorted(importer.READERS)), default=None,
+              help='По умолчанию — по расширению (.jsonl, .csv), каталог — markdown')
+@click.option('--chunk-size', default=5000, show_default=True, help='Строк в одной пачке (транзакции)')
+def import_content(kind, path, fmt, chunk_size):
+    """Загружает статьи или товары из JSONL, CSV или каталога Markdown (upsert по slug)."""
+    get_db()
+    try:
+        importer.import_rows(g.db_conn, g.is_postgres, kind, importer.read_rows(kind, path, fmt), chunk_size=chunk_size)
+    except importer.ImportFormatError as e:
+        raise click.ClickException(str(e))
+
+# ==============================================================================
+# НАГРАДЫ ЗА ЧТЕНИЕ
+# ==============================================================================
+READ_XP = 10
+READ_COINS = 5
+# XP на один уровень: level = 1 + xp // LEVEL_XP (пишется вместе с XP, activity-rollup выравнивает расхождения)
+LEVEL_XP = 100
+
+def _flush_rewards(batch):
+    # Вызывается из фонового потока, вне контекста запроса
+    with app.app_context():
+        get_repo().add_rewards(batch, LEVEL_XP)
+    # Распределение XP уже сдвинуто в api_read, устарел только топ
+    leaderboard.invalidate(histogram=False)
+
+_rewards = None
+_rewards_pid = None
+
+def get_reward_buffer():
+    # None, если отложенная запись выключена
+    global _rewards, _rewards_pid
+    if not app.config['REWARDS_WRITE_BEHIND']:
+        return None
+    if _rewards is None or _rewards_pid != os.getpid():
+        _rewards = RewardBuffer(_flush_rewards, interval=app.config['REWARDS_FLUSH_INTERVAL'],
+                                max_pending=app.config['REWARDS_FLUSH_SIZE'])
+        _rewards.start()
+        _rewards_pid = os.getpid()
+    return _rewards
+
+@app.cli.command('activity-rollup')
+@click.option('--lag', default=10, show_default=True, help='Не трогать события моложе стольких секунд')
+@click.option('--batch-size', default=1_000_000, show_default=True, help='Событий за одну транзакцию')
+def activity_rollup(lag, batch_size):
+    """Пересчитывает серии и уровни по новым событиям. Запускать по крону, например раз в минуту."""
+    started = time.perf_counter()
+    stats = activity.rollup(get_db(), g.is_postgres, LEVEL_XP, lag=lag, batch_size=batch_size)
+    leaderboard.invalidate()
+    print(f"✅ Отметка #{stats['watermark'] or 0:,}: серий {stats['streaks']:,}, сброшено {stats['reset']:,}, "
+          f"уровней {stats['levels']:,} за {time.perf_counter() - started:.1f} с")
+
+# ==============================================================================
+# ПОКУПКИ
+# ==============================================================================
+LOOTBOX_BONUS = 100
+
+# ==============================================================================
+# ДЕМО-РЕЖИМ
+# ==============================================================================
+# Гость без Telegram ничего не пишет в БД: его прогресс живёт в подписанной
+# cookie-сессии. Списки прочитанного и купленного ограничены по длине.
+GUEST_MAX_ITEMS = 200
+
+def new_guest_state():
+    return {'balance': 100, 'xp': 0, 'level': 1, 'reads': [], 'bought': []}
+
+def guest_user(state):
+    return User(id=0, telegram_id='guest', username='demo', first_name='Гость', photo_url='',
+                balance=state['balance'], xp=state['xp'], level=state['level'], streak=0)
+
+def guest_read(repo, state, aid):
+    if aid in state['reads'] or len(state['reads']) >= GUEST_MAX_ITEMS:
+        return False
+    if not repo.article_exists(aid):
+        return False
+    state['reads'].append(aid)
+    state['xp'] += READ_XP
+    state['level'] = 1 + state['xp'] // LEVEL_XP
+    state['balance'] += READ_COINS
+    session.modified = True
+    return True
+
+def guest_buy(repo, state, pid):
+    product = repo.get_product(pid)
+    if not product or len(state['bought']) >= GUEST_MAX_ITEMS:
+        return BUY_NOT_FOUND, None
+    if pid in state['bought']:
+        return BUY_OWNED, None
+    if state['balance'] < product.price:
+        return BUY_NO_FUNDS, None
+    state['bought'].append(pid)
+    state['balance'] += -product.price + (LOOTBOX_BONUS if product.type == 'lootbox' else 0)
+    session.modified = True
+    return BUY_OK, state['balance']
+
+@app.cli.command('cleanup-demo')
+@click.option('--batch-size', default=1000, show_default=True, help='Пользователей за одну транзакцию')
+def cleanup_demo(batch_size):
+    """Удаляет старых демо-пользователей (demo_*) вместе с их прочтениями и покупками."""
+    repo = get_repo()
+    total = 0
+    while True:
+        deleted = repo.delete_demo_users(batch_size)
+        if not deleted:
+            break
+        total += deleted
+        print(f"🧹 Удалено демо-пользователей: {total}")
+    leaderboard.invalidate()
+    print(f"✅ Готово, всего удалено: {total}")
+
 # ==============================================================================
 # АВТОРИЗАЦИЯ И МАРШРУТЫ
 # ==============================================================================
 def check_telegram_auth(init_data_str):
-    if not init_data_str: return None
     try:
-        parsed = urllib.parse.parse_qs(init_data_str)
-        hash_val = parsed.get('hash', [''])[0]
-        data_list = [f"{k}={parsed[k][0]}" for k in sorted(parsed.keys()) if k != 'hash']
-        secret = hashlib.sha256(Config.BOT_TOKEN.encode()).digest()
-        hmac_hash = hmac.new(secret, '\n'.join(data_list).encode(), hashlib.sha256).hexdigest()
-        if hmac_hash == hash_val:
-            return json.loads(parsed.get('user', ['{}'])[0])
+        return telegram_auth.verify(init_data_str)
     except Exception as e:
         print(f"Auth Error: {e}")
     return None
 
+def current_uid():
+    # Внутренний users.id кладётся в сессию при входе; для старых сессий
+    # без него разрешаем telegram_id один раз и запоминаем результат.
+    # У гостя строки в users нет, его id — 0.
+    if 'guest' in session:
+        return 0
+    uid = session.get('uid')
+    if uid is None:
+        uid = get_repo().user_id_by_telegram(session['user_id'])
+        if uid is None: return None
+        session['uid'] = uid
+    return uid
+
 def login_required(f):
     @wraps(f)
     def wrap(*args, **kwargs):
-        if 'user_id' not in session:
+        if 'user_id' not in session or current_uid() is None:
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return wrap
 
+def load_user():
+    # Текущий игрок: строка users или состояние гостя из сессии; None, если строки нет
+    state = session.get('guest')
+    if state is not None:
+        return guest_user(state)
+    return get_repo().get_user(session['uid'])
+
+def player_state(user):
+    # Состояние игрока для /api/me и ответов /api/read и /api/buy: по нему
+    # страница обновляется на месте. Уровень — из users, как на страницах.
+    # Награды из буфера write-behind ещё не в users — прибавляем их, а
+    # уровень с ними считаем так же, как его запишет add_rewards
+    xp, balance, level = user.xp, user.balance, user.level
+    buffer = get_reward_buffer() if 'guest' not in session else None
+    if buffer is not None:
+        pending_xp, pending_coins = buffer.pending(user.id)
+        if pending_xp:
+            xp, level = xp + pending_xp, 1 + (xp + pending_xp) // LEVEL_XP
+        balance += pending_coins
+    return {'balance': balance, 'xp': xp, 'level': level, 'streak': user.streak}
+
+@app.route('/api/health')
+def api_health():
+    data = {'ok': True}
+    if app.config['DATABASE_URL']:
+        data['pool'] = get_pool().stats()
+    elif app.config['SQLITE_ENGINE']:
+        data['sqlite'] = get_sqlite().stats()
+    return jsonify(data)
+
 @app.route('/')
 def index():
     init_data = request.args.get('tgWebAppData', '')
     user = check_telegram_auth(init_data)
     
-    if user:
-        session['user_id'] = str(user['id'])
-        session['name'] = user.get('first_name', 'User')
-        session['username'] = user.get('username', '')
-        session['photo'] = user.get('photo_url', '')
-    else:
-        # Демо режим
-        session['user_id'] = 'demo_' + str(os.urandom(4).hex())
-        session['name'] = 'Гость'
-        session['username'] = 'demo'
-        session['photo'] = ''
-    
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
+    if not user:
+        # Демо режим: в БД ничего не пишем, повторный вход сохраняет прогресс гостя
+        if 'guest' not in session:
+            session.clear()
+            session['user_id'] = 'guest'
+            session['name'] = 'Гость'
+            session['username'] = 'demo'
+            session['photo'] = ''
+            session['guest'] = new_guest_state()
+        return redirect(url_for('home'))
     
+    session.clear()
+    session['user_id'] = str(user['id'])
+    session['name'] = user.get('first_name', 'User')
+    session['username'] = user.get('username', '')
+    session['photo'] = user.get('photo_url', '')
+    # Upsert сразу возвращает внутренний id, чтобы маршруты не искали его по telegram_id
     try:
-        if is_pg:
-            cur.execute("""INSERT INTO users (telegram_id, username, first_name, photo_url, balance, xp, level) 
-                          VALUES (%s, %s, %s, %s, 100, 0, 1) ON CONFLICT (telegram_id) DO NOTHING""",
-                       (session['user_id'], session['username'], session['name'], session['photo']))
-        else:
-            cur.execute("""INSERT OR IGNORE INTO users (telegram_id, username, first_name, photo_url, balance, xp, level) 
-                          VALUES (?, ?, ?, ?, 100, 0, 1)""",
-                       (session['user_id'], session['username'], session['name'], session['photo']))
-            g.db_conn.commit()
+        session['uid'] = get_repo().upsert_user(session['user_id'], session['username'], session['name'], session['photo'])
     except Exception as e:
         print(f"DB Insert Error: {e}")
         
@@ -192,353 +619,223 @@ def index():
 @app.route('/home')
 @login_required
 def home():
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
-    query = "SELECT * FROM users WHERE telegram_id = %s" if is_pg else "SELECT * FROM users WHERE telegram_id = ?"
-    cur.execute(query, (session['user_id'],))
-    row = cur.fetchone()
-    
-    if not row: return redirect(url_for('index'))
-    
-    user = {'id': row[0], 'telegram_id': row[1], 'username': row[2], 'first_name': row[3], 
-            'photo_url': row[4], 'balance': row[5], 'xp': row[6], 'level': row[7], 'streak': row[8]} if is_pg else dict(row)
+    user = load_user()
+    if not user: return redirect(url_for('index'))
         
-    return render_template_string(HTML_HOME, user=user)
+    return render_template('home.html', user=user)
 
 @app.route('/library')
 @login_required
+@read_only
 def library():
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
+    repo = get_repo()
     
-    cur.execute("SELECT * FROM articles ORDER BY category")
-    rows = cur.fetchall()
+    # В список попадают только метаданные и короткий анонс; текст статьи
+    # подгружается по клику через /api/article/<id>
+    page = max(request.args.get('page', 1, type=int), 1)
+    category = request.args.get('category') or None
+    per_page = app.config['LIBRARY_PAGE_SIZE']
+    uid = current_uid()
+    guest = session.get('guest')
     
-    uid_query = "SELECT id FROM users WHERE telegram_id = %s" if is_pg else "SELECT id FROM users WHERE telegram_id = ?"
-    cur.execute(uid_query, (session['user_id'],))
-    uid_row = cur.fetchone()
-    uid = uid_row[0] if uid_row else 0
+    # Счётчик прочитанного берётся по префиксу первичного ключа user_reads.
+    # Прочтения только добавляются, поэтому вместе с версией каталога он
+    # однозначно определяет содержимое страницы.
+    read_count = repo.read_count(uid) if guest is None else len(guest['reads'])
+    version = catalog.get(repo.catalog_versions).get('articles')
+    etag = page_etag(version, uid, read_count)
+    cached = not_modified(etag)
+    if cached: return cached
     
-    read_query = "SELECT article_id FROM user_reads WHERE user_id = %s" if is_pg else "SELECT article_id FROM user_reads WHERE user_id = ?"
-    cur.execute(read_query, (uid,))
-    read_rows = cur.fetchall()
-    read_ids = [r[0] for r in read_rows]
+    def render_nav():
+        total = repo.count_articles(category)
+        nav = render_template('_library_nav.html', all_categories=repo.categories(), category=category)
+        return total, Markup(nav)
     
+    # Общая для всех часть каталога: счётчик статей и навигация по категориям
+    total, nav = fragments.get_or_render(('library_nav', version, category), render_nav)
+    pages = max((total + per_page - 1) // per_page, 1)
+    
+    # Статус прочтения считает сама БД (LEFT JOIN по статьям страницы),
+    # строки раскладываются по категориям прямо из курсора
     categories = {}
-    for row in rows:
-        if is_pg:
-            art = {'id': row[0], 'category': row[1], 'title': row[2], 'content': row[3], 'read_time': row[4], 'tags': row[5]}
-        else:
-            art = dict(row)
+    for art in repo.list_articles(uid, category, per_page, (page - 1) * per_page):
+        if guest is not None:
+            art = art._replace(is_read=art.id in guest['reads'])
+        categories.setdefault(art.category, []).append(art)
         
-        cat = art['category']
-        if cat not in categories: categories[cat] = []
-        art['is_read'] = art['id'] in read_ids
-        categories[cat].append(art)
-        
-    return render_template_string(HTML_LIBRARY, categories=categories, total=len(rows), read_count=len(read_ids))
+    html = render_template('library.html', categories=categories, total=total, read_count=read_count,
+                           page=page, pages=pages, category=category, nav=nav)
+    return cacheable(html, etag)
+
+@app.route('/api/article/<int:aid>')
+@login_required
+@read_only
+def api_article(aid):
+    art = get_repo().get_article(aid)
+    if not art: abort(404)
+    
+    resp = jsonify(art._asdict())
+    resp.set_etag(hashlib.md5(resp.get_data()).hexdigest())
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 300
+    return resp.make_conditional(request)
+
+@app.route('/api/search')
+@login_required
+@read_only
+def api_search():
+    # Ранжированный полнотекстовый поиск по названию, тегам и тексту статей
+    q = request.args.get('q', '')[:200]
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_PAGE_SIZE']
+    guest = session.get('guest')
+    
+    # Лишняя строка говорит, есть ли следующая страница, без count(*) по всем совпадениям
+    found = get_repo().search_articles(current_uid(), q, per_page + 1, (page - 1) * per_page)
+    results = []
+    for art in found[:per_page]:
+        if guest is not None:
+            art = art._replace(is_read=art.id in guest['reads'])
+        results.append(art._asdict())
+    return jsonify({'ok': True, 'q': q, 'page': page, 'results': results, 'has_more': len(found) > per_page})
+
+@app.route('/api/me')
+@login_required
+@read_only
+def api_me():
+    # Лёгкое состояние игрока: страница обновляет счётчики, не перерисовываясь
+    uid = current_uid()
+    guest = session.get('guest')
+    if guest is None:
+        user, read_count, bought_count = gather(lambda r: r.get_user(uid), lambda r: r.read_count(uid),
+                                                lambda r: r.purchase_count(uid))
+    else:
+        user, read_count, bought_count = guest_user(guest), len(guest['reads']), len(guest['bought'])
+    if not user: return jsonify({'ok': False}), 404
+
+    state = player_state(user)
+    state.update(read_count=read_count, bought_count=bought_count)
+    resp = jsonify({'ok': True, 'user': state})
+    resp.cache_control.private = True
+    resp.cache_control.no_store = True
+    return resp
 
 @app.route('/shop')
 @login_required
+@read_only
 def shop():
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
-    
-    u_query = "SELECT * FROM users WHERE telegram_id = %s" if is_pg else "SELECT * FROM users WHERE telegram_id = ?"
-    cur.execute(u_query, (session['user_id'],))
-    row = cur.fetchone()
-    user = {'id': row[0], 'balance': row[5]} if is_pg else dict(row)
-    uid = user['id']
-    bal = user['balance']
+    repo = get_repo()
+    uid = current_uid()
+    guest = session.get('guest')
+    if guest is None:
+        user, bought_count = gather(lambda r: r.get_user(uid), lambda r: r.purchase_count(uid))
+    else:
+        user, bought_count = guest_user(guest), len(guest['bought'])
+    if not user: return redirect(url_for('index'))
     
-    cur.execute("SELECT * FROM products")
-    items = cur.fetchall()
+    # Покупки только добавляются: баланс + их число + версия товаров = версия страницы
+    version = catalog.get(repo.catalog_versions).get('products')
+    etag = page_etag(version, user.id, user.balance, bought_count)
+    cached = not_modified(etag)
+    if cached: return cached
     
-    b_query = "SELECT product_id FROM purchases WHERE user_id = %s" if is_pg else "SELECT product_id FROM purchases WHERE user_id = ?"
-    cur.execute(b_query, (uid,))
-    bought_rows = cur.fetchall()
-    bought_ids = [r[0] for r in bought_rows]
+    products = lambda r: fragments.get_or_render(('products', version), r.list_products)
+    if guest is None:
+        items, bought_ids = gather(products, lambda r: r.purchased_ids(uid))
+    else:
+        items, bought_ids = products(repo), set(guest['bought'])
     
     shop_items = []
     for item in items:
-        d = {'id': item[0], 'name': item[1], 'price': item[2], 'icon': item[3], 'desc': item[4], 'type': item[5]} if is_pg else dict(item)
-        d['bought'] = d['id'] in bought_ids
-        d['can_buy'] = bal >= d['price']
+        d = item._asdict()
+        d['bought'] = item.id in bought_ids
+        d['can_buy'] = user.balance >= item.price
         shop_items.append(d)
         
-    return render_template_string(HTML_SHOP, items=shop_items, user=user)
+    return cacheable(render_template('shop.html', items=shop_items, user=user), etag)
 
 @app.route('/stats')
 @login_required
+@read_only
 def stats():
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
-    
-    cur.execute("SELECT first_name, xp, level FROM users ORDER BY xp DESC LIMIT 10")
-    top_rows = cur.fetchall()
-    top = [{'first_name': r[0], 'xp': r[1], 'level': r[2]} for r in top_rows]
+    repo = get_repo()
+    me = load_user()
+    if not me: return redirect(url_for('index'))
+    top = leaderboard.top(repo)
+    rank = leaderboard.rank(repo, me.xp)
     
-    u_query = "SELECT * FROM users WHERE telegram_id = %s" if is_pg else "SELECT * FROM users WHERE telegram_id = ?"
-    cur.execute(u_query, (session['user_id'],))
-    row = cur.fetchone()
-    me = {'id': row[0], 'balance': row[5], 'xp': row[6], 'level': row[7]} if is_pg else dict(row)
-    
-    return render_template_string(HTML_STATS, top=top, me=me)
+    return render_template('stats.html', top=top, user=me, rank=rank)
 
 @app.route('/profile')
 @login_required
 def profile():
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
-    
-    u_query = "SELECT * FROM users WHERE telegram_id = %s" if is_pg else "SELECT * FROM users WHERE telegram_id = ?"
-    cur.execute(u_query, (session['user_id'],))
-    row = cur.fetchone()
-    user = {'id': row[0], 'telegram_id': row[1], 'username': row[2], 'first_name': row[3], 'photo_url': row[4], 'streak': row[8]} if is_pg else dict(row)
+    user = load_user()
+    if not user: return redirect(url_for('index'))
     
-    return render_template_string(HTML_PROFILE, user=user, earned_ach=0, total_ach=5)
+    return render_template('profile.html', user=user, earned_ach=0, total_ach=5)
 
 @app.route('/api/read/<int:aid>', methods=['POST'])
 @login_required
 def api_read(aid):
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
+    repo = get_repo()
     
-    uid_query = "SELECT id FROM users WHERE telegram_id = %s" if is_pg else "SELECT id FROM users WHERE telegram_id = ?"
-    cur.execute(uid_query, (session['user_id'],))
-    uid = cur.fetchone()[0]
+    if 'guest' in session:
+        credited = guest_read(repo, session['guest'], aid)
+        is_read = aid in session['guest']['reads']
+    else:
+        buffer = get_reward_buffer()
+        try:
+            credited, _ = repo.record_read(session['uid'], aid, READ_XP, READ_COINS, LEVEL_XP,
+                                           defer=buffer is not None)
+        except Exception as e:
+            print(f"Read Error: {e}")
+            return jsonify({'ok': False}), 500
+        if credited and buffer is not None:
+            buffer.add(session['uid'], READ_XP, READ_COINS)
+        # Не засчитано: статья уже прочитана или её нет
+        is_read = credited or repo.article_exists(aid)
     
-    try:
-        if is_pg:
-            cur.execute("""INSERT INTO user_reads (user_id, article_id, is_read) VALUES (%s, %s, TRUE) 
-                          ON CONFLICT (user_id, article_id) DO UPDATE SET is_read=TRUE""", (uid, aid))
-            cur.execute("UPDATE users SET xp = xp + 10, balance = balance + 5 WHERE id = %s", (uid,))
-        else:
-            cur.execute("INSERT OR REPLACE INTO user_reads (user_id, article_id, is_read) VALUES (?, ?, 1)", (uid, aid))
-            cur.execute("UPDATE users SET xp = xp + 10, balance = balance + 5 WHERE id = ?", (uid,))
-            g.db_conn.commit()
-    except Exception as e:
-        print(f"Read Error: {e}")
-        return jsonify({'ok': False}), 500
-        
-    return jsonify({'ok': True})
+    # Новое состояние — в ответе: страница не перезагружается ради баланса и XP
+    user = load_user()
+    state = player_state(user) if user else None
+    if credited and state and 'guest' not in session:
+        # XP с учётом ещё не записанных наград: для места в /stats
+        leaderboard.xp_changed(state['xp'] - READ_XP, state['xp'])
+    return jsonify({'ok': True, 'credited': credited, 'article_id': aid, 'is_read': is_read, 'user': state})
 
 @app.route('/api/buy/<int:pid>', methods=['POST'])
 @login_required
 def api_buy(pid):
-    cur = get_db()
-    is_pg = getattr(g, 'is_postgres', False)
+    repo = get_repo()
     
-    u_query = "SELECT id, balance FROM users WHERE telegram_id = %s" if is_pg else "SELECT id, balance FROM users WHERE telegram_id = ?"
-    cur.execute(u_query, (session['user_id'],))
-    u = cur.fetchone()
-    
-    p_query = "SELECT price FROM products WHERE id = %s" if is_pg else "SELECT price FROM products WHERE id = ?"
-    cur.execute(p_query, (pid,))
-    p = cur.fetchone()
-    
-    if not u or not p:
-        return jsonify({'ok': False, 'error': 'Ошибка данных'}), 400
-        
-    if u[1] >= p[0]:
-        try:
-            if is_pg:
-                cur.execute("UPDATE users SET balance = balance - %s WHERE id = %s", (p[0], u[0]))
-                cur.execute("INSERT INTO purchases (user_id, product_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (u[0], pid))
-                if pid == 3: # Lootbox
-                    bonus = 100
-                    cur.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (bonus, u[0]))
-            else:
-                cur.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (p[0], u[0]))
-                cur.execute("INSERT OR IGNORE INTO purchases (user_id, product_id) VALUES (?, ?)", (u[0], pid))
-                if pid == 3:
-                    cur.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (100, u[0]))
-                g.db_conn.commit()
-                
-            new_bal = u[1] - p[0]
-            if pid == 3: new_bal += 100
-            
-            return jsonify({'ok': True, 'new_bal': new_bal, 'msg': 'Куплено!'})
-        except Exception as e:
-            print(f"Buy Error: {e}")
-            return jsonify({'ok': False, 'error': str(e)}), 500
+    try:
+        if 'guest' in session:
+            status, new_bal = guest_buy(repo, session['guest'], pid)
+        else:
+            # Монеты за прочтения из буфера write-behind сначала в users:
+            # иначе баланс на странице их показывает, а списание не видит
+            buffer = get_reward_buffer()
+            if buffer is not None:
+                buffer.flush_user(session['uid'])
+            status, new_bal = repo.purchase(session['uid'], pid, LOOTBOX_BONUS)
+    except Exception as e:
+        print(f"Buy Error: {e}")
+        return jsonify({'ok': False, 'error': 'Ошибка покупки'}), 500
     
-    return jsonify({'ok': False, 'error': 'Недостаточно монет'}), 400
-
-# ==============================================================================
-# HTML ШАБЛОНЫ (Упрощенные для надежности)
-# ==============================================================================
-CSS_STYLE = """
-:root { --bg: #0f0f13; --card: #1e1e24; --accent: #00ff88; --text: #fff; }
-body { background: var(--bg); color: var(--text); font-family: sans-serif; margin: 0; padding-bottom: 70px; }
-.container { max-width: 600px; margin: 0 auto; padding: 20px; }
-h1 { color: var(--accent); }
-.card { background: var(--card); padding: 15px; border-radius: 12px; margin-bottom: 15px; border: 1px solid #333; cursor: pointer; }
-.btn { background: var(--accent); color: #000; border: none; padding: 10px; width: 100%; border-radius: 8px; font-weight: bold; margin-top: 10px; cursor: pointer; }
-.btn:disabled { background: #444; color: #888; }
-.nav { position: fixed; bottom: 0; left: 0; right: 0; background: var(--card); display: flex; justify-content: space-around; padding: 10px; border-top: 1px solid #333; }
-.nav a { color: #aaa; text-decoration: none; font-size: 12px; text-align: center; }
-.nav a.active { color: var(--accent); }
-.modal { display: none; position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0,0,0,0.9); z-index: 1000; justify-content: center; align-items: center; }
-.modal.open { display: flex; }
-.modal-content { background: var(--card); padding: 20px; border-radius: 12px; width: 90%; max-height: 80vh; overflow-y: auto; position: relative; }
-.close-btn { position: absolute; top: 10px; right: 15px; font-size: 24px; cursor: pointer; color: #fff; background: none; border: none; }
-.modal-text { white-space: pre-wrap; line-height: 1.6; margin-top: 15px; }
-"""
-
-HTML_BASE = f"""
-<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>HabitMaster Pro</title>
-    <style>{CSS_STYLE}</style>
-    <script src="https://telegram.org/js/telegram-web-app.js"></script>
-    <script>
-        Telegram.WebApp.ready();
-        Telegram.WebApp.expand();
-        function openModal(id, title, content, isRead) {{
-            document.getElementById('mTitle').innerText = title;
-            document.getElementById('mText').innerText = content;
-            const btn = document.getElementById('mBtn');
-            if(isRead) {{
-                btn.disabled = true; btn.innerText = '✓ Прочитано'; btn.style.background = '#444';
-            }} else {{
-                btn.disabled = false; btn.innerText = 'Отметить прочитанным (+10 XP)'; btn.style.background = 'var(--accent)';
-                btn.onclick = function() {{ markRead(id); }};
-            }}
-            document.getElementById('articleModal').classList.add('open');
-        }}
-        function closeModal() {{ document.getElementById('articleModal').classList.remove('open'); }}
-        async function markRead(id) {{
-            const r = await fetch('/api/read/' + id, {{method: 'POST'}});
-            if((await r.json()).ok) {{ alert('+10 XP'); location.reload(); }}
-        }}
-        async function buyItem(id) {{
-            if(!confirm('Купить?')) return;
-            const r = await fetch('/api/buy/' + id, {{method: 'POST'}});
-            const d = await r.json();
-            alert(d.msg || d.error);
-            if(d.ok) location.reload();
-        }}
-    </script>
-</head>
-<body>
-    <div class="container">{{{{ block_content }}}}</div>
-    <div class="modal" id="articleModal">
-        <div class="modal-content">
-            <button class="close-btn" onclick="closeModal()">×</button>
-            <h2 id="mTitle" style="color:var(--accent)"></h2>
-            <div id="mText" class="modal-text"></div>
-            <button id="mBtn" class="btn" style="margin-top:20px;">Отметить прочитанным</button>
-        </div>
-    </div>
-    <nav class="nav">
-        <a href="/home" class="{{{{ 'active' if request.endpoint == 'home' else '' }}}}" >🏠<br>Главная</a>
-        <a href="/library" class="{{{{ 'active' if request.endpoint == 'library' else '' }}}}" >📚<br>Книги</a>
-        <a href="/shop" class="{{{{ 'active' if request.endpoint == 'shop' else '' }}}}" >🛒<br>Магазин</a>
-        <a href="/stats" class="{{{{ 'active' if request.endpoint == 'stats' else '' }}}}" >📊<br>Топ</a>
-        <a href="/profile" class="{{{{ 'active' if request.endpoint == 'profile' else '' }}}}" >👤<br>Профиль</a>
-    </nav>
-</body>
-</html>
-"""
-
-HTML_HOME = """{% extends "base" %}{% block content %}
-<h1>Привет, {{ user.first_name }}!</h1>
-<div class="card" style="text-align:center; margin-bottom:20px;">
-    <h2 style="color:var(--accent); margin:0;">💰 {{ user.balance }}</h2>
-    <p>Уровень: {{ user.level }} | XP: {{ user.xp }}</p>
-</div>
-<div class="card" onclick="location.href='/library'" style="display:flex; align-items:center; gap:15px;">
-    <div style="font-size:30px;">📚</div>
-    <div><b>Библиотека</b><br><small style="color:#aaa">Читать и получать XP</small></div>
-</div>
-<div class="card" onclick="location.href='/shop'" style="display:flex; align-items:center; gap:15px;">
-    <div style="font-size:30px;">🛒</div>
-    <div><b>Магазин</b><br><small style="color:#aaa">Тратить монеты</small></div>
-</div>
-{% endblock %}"""
-
-HTML_LIBRARY = """{% extends "base" %}{% block content %}
-<h1>Библиотека</h1>
-<p>Прочитано: {{ read_count }}/{{ total }}</p>
-{% for cat, arts in categories.items() %}
-    <h3 style="color:var(--accent); margin-top:20px;">📂 {{ cat }}</h3>
-    {% for art in arts %}
-    <div class="card" onclick="openModal({{ art.id }}, '{{ art.title }}', '{{ art.content|replace("'", "\\'")|replace('\n', '\\n') }}', {{ 'true' if art.is_read else 'false' }})">
-        <div style="display:flex; justify-content:space-between;">
-            <b>{{ art.title }}</b>
-            <span style="background:#333; padding:2px 6px; border-radius:4px; font-size:11px;">{{ '✓' if art.is_read else art.read_time }}</span>
-        </div>
-        <p style="font-size:13px; color:#aaa; margin-top:5px;">{{ art.content[:80] }}...</p>
-    </div>
-    {% endfor %}
-{% endfor %}
-{% endblock %}"""
-
-HTML_SHOP = """{% extends "base" %}{% block content %}
-<h1>Магазин</h1>
-<div class="card" style="text-align:center"><h2>💰 {{ user.balance }}</h2></div>
-{% for item in items %}
-<div class="card" style="display:flex; align-items:center; gap:10px;">
-    <div style="font-size:30px;">{{ item.icon }}</div>
-    <div style="flex:1;">
-        <b>{{ item.name }}</b><br><small style="color:#aaa">{{ item.desc }}</small><br>
-        <span style="color:var(--accent); font-weight:bold;">{{ item.price }} монет</span>
-    </div>
-    <div style="width:80px;">
-        {% if item.bought %}
-            <button class="btn" disabled style="padding:5px; font-size:12px;">Куплено</button>
-        {% elif item.can_buy %}
-            <button class="btn" onclick="buyItem({{ item.id }})" style="padding:5px; font-size:12px;">Купить</button>
-        {% else %}
-            <button class="btn" disabled style="background:#444; padding:5px; font-size:12px;">Нет ₿</button>
-        {% endif %}
-    </div>
-</div>
-{% endfor %}
-{% endblock %}"""
-
-HTML_STATS = """{% extends "base" %}{% block content %}
-<h1>Рейтинг</h1>
-<div class="card">
-    {% for p in top %}
-    <div style="display:flex; justify-content:space-between; padding:8px 0; border-bottom:1px solid #333;">
-        <span>#{{ loop.index }} {{ p.first_name }} (Lvl {{ p.level }})</span>
-        <span style="color:var(--accent); font-weight:bold;">{{ p.xp }} XP</span>
-    </div>
-    {% endfor %}
-</div>
-<div class="card" style="margin-top:20px;">
-    <h3>Твоя статистика</h3>
-    <p>Уровень: <b>{{ me.level }}</b></p>
-    <p>XP: <b>{{ me.xp }}</b></p>
-    <p>Баланс: <b>{{ me.balance }}</b></p>
-</div>
-{% endblock %}"""
-
-HTML_PROFILE = """{% extends "base" %}{% block content %}
-<h1>Профиль</h1>
-<div class="card" style="text-align:center; padding:30px 20px;">
-    <div style="width:80px; height:80px; background:#333; border-radius:50%; margin:0 auto 15px; display:flex; align-items:center; justify-content:center; font-size:30px; border:3px solid var(--accent);">
-        {{ user.first_name[0] if user.first_name else 'U' }}
-    </div>
-    <h2>{{ user.first_name }}</h2>
-    <p style="color:#aaa;">@{{ user.username or 'anon' }}</p>
-    <p style="color:#666; font-size:12px;">ID: {{ user.telegram_id }}</p>
-</div>
-{% endblock %}"""
-
-def render_template_string(template, **kwargs):
-    from flask import render_template_string as rts
-    final_html = template.replace('{% extends "base" %}', '').replace('{% block content %}', '').replace('{% endblock %}', '')
-    full_page = HTML_BASE.replace('{{{{ block_content }}}}', final_html)
-    full_page = full_page.replace('{{{{', '{{').replace('}}}}', '}}')
-    return rts(full_page, **kwargs)
+    if status == BUY_OK:
+        user = load_user()
+        return jsonify({'ok': True, 'new_bal': new_bal, 'msg': 'Куплено!', 'product_id': pid, 'bought': True,
+                        'user': player_state(user) if user else None})
+    errors = {
+        BUY_NOT_FOUND: 'Ошибка данных',
+        BUY_OWNED: 'Уже куплено',
+        BUY_NO_FUNDS: 'Недостаточно монет',
+    }
+    return jsonify({'ok': False, 'error': errors[status]}), 400
 
 if __name__ == '__main__':
     print("🚀 Запуск HabitMaster Pro...")
-    init_db()
+    with app.app_context():
+        init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1 @@
+# Бенчмарки HabitMaster Pro. Запуск: python -m bench.<имя>
@@ -0,0 +1,52 @@
+"""Скорость проверки initData Telegram.
+
+    python -m bench.auth [итераций]
+"""
+import hashlib
+import hmac
+import json
+import sys
+import time
+import urllib.parse
+
+from telegram_auth import TelegramAuth
+
+TOKEN = '123456:bench-token'
+
+
+def legacy_verify(init_data):
+    # Прежняя реализация: ключ и разбор строки заново на каждый вызов
+    parsed = urllib.parse.parse_qs(init_data)
+    hash_val = parsed.get('hash', [''])[0]
+    data_list = [f"{k}={parsed[k][0]}" for k in sorted(parsed.keys()) if k != 'hash']
+    secret = hmac.new(b'WebAppData', TOKEN.encode(), hashlib.sha256).digest()
+    if hmac.new(secret, '\n'.join(data_list).encode(), hashlib.sha256).hexdigest() == hash_val:
+        return json.loads(parsed.get('user', ['{}'])[0])
+    return None
+
+
+def _rate(fn, samples, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(samples[i % len(samples)])
+    return n / (time.perf_counter() - start)
+
+
+def main(n=100000):
+    auth = TelegramAuth(TOKEN, cache_size=2048)
+    samples = [auth.sign({'id': i, 'first_name': f'User {i}', 'username': f'user{i}'}, query_id=f'AAE{i}')
+               for i in range(1000)]
+    assert all(auth.verify(s) for s in samples) and all(legacy_verify(s) for s in samples)
+
+    cold = TelegramAuth(TOKEN, cache_size=0)
+    results = {
+        'legacy (ключ + parse_qs на каждый вызов)': _rate(legacy_verify, samples, n),
+        'без кэша (ключ посчитан заранее)': _rate(cold.verify, samples, n),
+        'повторные запуски (LRU)': _rate(auth.verify, samples, n),
+    }
+    for name, rate in results.items():
+        print(f"{name:<42} {rate:>12,.0f} проверок/с")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
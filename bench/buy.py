@@ -0,0 +1,137 @@
+"""Нагрузочный тест покупок: гонки двойного клика и пропускная способность.
+
+    python -m bench.buy [потоков]
+
+По умолчанию работает на временной SQLite. Для PostgreSQL укажите
+BENCH_DATABASE_URL на отдельную пустую базу — тест создаёт и заполняет таблицы.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import app as habit
+from repository import Repository, BUY_OK
+
+PRODUCTS = 20
+USERS = 200
+
+
+def _connect(url, path):
+    if url:
+        import psycopg2
+        conn = psycopg2.connect(url)
+        conn.autocommit = True
+        return conn
+    return sqlite3.connect(path, timeout=30)
+
+
+def _setup(url, path):
+    habit.app.config['DATABASE_URL'] = url
+    with habit.app.app_context():
+        habit.init_db()
+    conn = _connect(url, path)
+    cur = conn.cursor()
+    ph = '%s' if url else '?'
+    cur.execute("DELETE FROM purchases")
+    cur.execute("DELETE FROM products")
+    cur.execute("DELETE FROM users WHERE telegram_id LIKE 'bench_%'")
+    for i in range(PRODUCTS):
+        kind = 'lootbox' if i % 5 == 0 else 'booster'
+        cur.execute(f"INSERT INTO products (name, price, icon, type) VALUES ({ph}, {ph}, '⚡', {ph})",
+                    (f'bench {i}', 100 + 10 * i, kind))
+    cur.execute("SELECT id, price, type FROM products")
+    products = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+    for i in range(USERS):
+        cur.execute(f"INSERT INTO users (telegram_id, first_name, balance) VALUES ({ph}, 'bench', 1000000)",
+                    (f'bench_{i}',))
+    cur.execute("SELECT id FROM users WHERE telegram_id LIKE 'bench_%' ORDER BY id")
+    users = [r[0] for r in cur.fetchall()]
+    if not url:
+        conn.commit()
+    conn.close()
+    return products, users
+
+
+def _run(threads, url, path, jobs_for):
+    counts = {'ok': 0, 'fail': 0}
+    lock = threading.Lock()
+
+    def worker(n):
+        conn = _connect(url, path)
+        repo = Repository(conn, bool(url))
+        local = {'ok': 0, 'fail': 0}
+        for uid, pid in jobs_for(n):
+            status, _ = repo.purchase(uid, pid, habit.LOOTBOX_BONUS)
+            local['ok' if status == BUY_OK else 'fail'] += 1
+        repo.close()
+        conn.close()
+        with lock:
+            counts['ok'] += local['ok']
+            counts['fail'] += local['fail']
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts, time.perf_counter() - start
+
+
+def race(threads, url, path, products, uid):
+    # Один игрок, у которого хватает монет примерно на половину товаров;
+    # каждый поток пытается купить всё — это и двойной клик, и конкурирующие покупки
+    budget = sum(price for price, _ in products.values()) // 2
+    conn = _connect(url, path)
+    ph = '%s' if url else '?'
+    conn.cursor().execute(f"UPDATE users SET balance = {ph} WHERE id = {ph}", (budget, uid))
+    if not url:
+        conn.commit()
+
+    def jobs(n):
+        ids = list(products)
+        random.Random(n).shuffle(ids)
+        return [(uid, pid) for pid in ids]
+
+    counts, _ = _run(threads, url, path, jobs)
+
+    cur = conn.cursor()
+    cur.execute(f"SELECT product_id FROM purchases WHERE user_id = {ph}", (uid,))
+    bought = [r[0] for r in cur.fetchall()]
+    cur.execute(f"SELECT balance FROM users WHERE id = {ph}", (uid,))
+    balance = cur.fetchone()[0]
+    conn.close()
+
+    spent = sum(products[p][0] - (habit.LOOTBOX_BONUS if products[p][1] == 'lootbox' else 0) for p in bought)
+    ok = counts['ok'] == len(bought) == len(set(bought)) and balance == budget - spent and balance >= 0
+    print(f"race: {threads} потоков, куплено {len(bought)}, баланс {budget} -> {balance}, "
+          f"{'OK' if ok else 'ПОТЕРЯННЫЕ ОБНОВЛЕНИЯ!'}")
+    return ok
+
+
+def throughput(threads, url, path, products, users):
+    jobs = [(uid, pid) for uid in users[1:] for pid in products]
+    random.Random(0).shuffle(jobs)
+    counts, elapsed = _run(threads, url, path, lambda n: jobs[n::threads])
+    print(f"throughput: {counts['ok']} покупок за {elapsed:.2f} с = {counts['ok'] / elapsed:,.0f} покупок/с "
+          f"({threads} потоков)")
+
+
+def main(threads=8):
+    url = os.environ.get('BENCH_DATABASE_URL')
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    path = os.path.join(workdir, 'habitmaster.db')
+    print(f"backend: {'postgres' if url else 'sqlite ' + path}")
+    products, users = _setup(url, path)
+    ok = race(threads, url, path, products, users[0])
+    throughput(threads, url, path, products, users)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8))
@@ -0,0 +1,89 @@
+"""Нагрузочный тест: sync-воркеры gunicorn против ASYNC_MODE=gevent.
+
+    python -m bench.concurrency [клиентов] [секунд] [воркеров]
+
+Поднимает gunicorn на свободном порту в каждом режиме с одинаковым числом
+воркеров и гоняет N одновременных клиентов по /shop и /library. Печатает
+пропускную способность, задержки и суммарную RSS master + воркеры: у gevent
+одновременность растёт без роста числа процессов. Эффект виден на
+PostgreSQL (BENCH_DATABASE_URL), где запрос ждёт сеть; на SQLite оба
+режима упираются в CPU. Для локальной базы BENCH_DB_LATENCY_MS добавляет
+задержку ответа БД через TCP-прокси, как у базы в соседнем дата-центре.
+"""
+import http.cookiejar
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench.server import ROOT, TOKEN, gunicorn, latency_proxy, rss_kb
+from telegram_auth import TelegramAuth
+
+PATHS = ('/shop', '/library')
+
+
+def _client(base, n, deadline, latencies, errors):
+    auth = TelegramAuth(TOKEN)
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    init = auth.sign({'id': 50_000 + n, 'first_name': f'Load {n}'})
+    opener.open(base + '/?tgWebAppData=' + urllib.parse.quote(init), timeout=30).read()
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            opener.open(base + PATHS[i % len(PATHS)], timeout=30).read()
+            latencies.append(time.perf_counter() - start)
+        except (OSError, urllib.error.URLError):
+            errors.append(1)
+        i += 1
+
+
+def run_mode(mode, env, clients, seconds, workers):
+    with gunicorn(env, workers, mode) as (base, server):
+        latencies, errors = [], []
+        deadline = time.perf_counter() + seconds
+        pool = [threading.Thread(target=_client, args=(base, n, deadline, latencies, errors))
+                for n in range(clients)]
+        start = time.perf_counter()
+        for t in pool:
+            t.start()
+        peak = 0
+        while any(t.is_alive() for t in pool):
+            peak = max(peak, rss_kb(server.pid))
+            time.sleep(0.5)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    print(f"{mode or 'sync':<7} {len(latencies) / elapsed:>8,.0f} запросов/с  "
+          f"p50 {statistics.median(latencies) * 1000 if latencies else 0:>7.1f} мс  p95 {p95 * 1000:>7.1f} мс  "
+          f"ошибок {len(errors):>4}  RSS {peak / 1024:>6.1f} МБ  ({workers} воркеров, {clients} клиентов)")
+
+
+def main(clients=100, seconds=10.0, workers=2):
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, BOT_TOKEN=TOKEN, SQLITE_PATH=os.path.join(workdir, 'habitmaster.db'))
+    url = os.environ.get('BENCH_DATABASE_URL')
+    latency = float(os.environ.get('BENCH_DB_LATENCY_MS', 0)) / 1000
+    if url:
+        env['DATABASE_URL'] = latency_proxy(url, latency) if latency else url
+    else:
+        env.pop('DATABASE_URL', None)
+    print(f"backend: {'postgres' if url else 'sqlite ' + env['SQLITE_PATH']}"
+          + (f", задержка БД {latency * 1000:.0f} мс" if url and latency else ''))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db-upgrade'], cwd=ROOT, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    for mode in ('', 'gevent'):
+        run_mode(mode, env, clients, seconds, workers)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 10.0,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 2)
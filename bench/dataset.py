@@ -0,0 +1,221 @@
+"""Синтетический набор данных для нагрузочных тестов.
+
+    python -m bench.dataset --scale small [--reset]
+    python -m bench.dataset --users 1000000 --articles 50000 --reads 20000000 --reset
+
+Заполняет users, articles, user_reads, products, purchases и журнал
+activity_events детерминированно (--seed): один и тот же запуск даёт одну и
+ту же базу, время событий отсчитывается от момента запуска. Схема создаётся
+миграциями. SQLite — путь SQLITE_PATH (по умолчанию habitmaster.db), PostgreSQL —
+BENCH_DATABASE_URL; туда строки идут через COPY.
+
+У игроков telegram_id = TG_BASE + номер, так что драйвер (bench.driver)
+входит под ними подписанным initData.
+"""
+import argparse
+import io
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import app as habit
+
+TG_BASE = 7_000_000_000
+CATEGORIES = ('Энергия', 'Привычки', 'Дофамин', 'Сон', 'Фокус', 'Спорт', 'Питание', 'Стресс',
+              'Утро', 'Деньги', 'Обучение', 'Отношения')
+WORDS = ('привычка', 'энергия', 'сон', 'утро', 'шаг', 'цель', 'фокус', 'серия', 'дофамин', 'отдых',
+         'система', 'минимум', 'прогресс', 'день', 'вода', 'движение', 'режим', 'внимание')
+SCALES = {
+    'tiny': dict(users=1_000, articles=300, reads=20_000, products=20, purchases=2_000),
+    'small': dict(users=20_000, articles=3_000, reads=400_000, products=50, purchases=40_000),
+    'medium': dict(users=200_000, articles=10_000, reads=4_000_000, products=100, purchases=400_000),
+    'large': dict(users=1_000_000, articles=50_000, reads=20_000_000, products=200, purchases=2_000_000),
+}
+CHUNK = 50_000
+
+TABLES = {
+    'users': ('id', 'telegram_id', 'username', 'first_name', 'photo_url', 'balance', 'xp', 'level', 'streak'),
+    'articles': ('id', 'title', 'category', 'content', 'read_time', 'tags'),
+    'products': ('id', 'name', 'price', 'icon', 'desc', 'type'),
+    'user_reads': ('user_id', 'article_id', 'is_read'),
+    'purchases': ('user_id', 'product_id'),
+    'activity_events': ('user_id', 'kind', 'ref_id', 'created_at'),
+}
+# События прочтений и покупок раскиданы по стольким последним дням
+EVENT_DAYS = 30
+
+
+def _per_user(total, users, rnd, limit):
+    # Сколько строк у каждого игрока: неравномерно (есть активные и молчуны), в сумме ~total
+    mean = total / users if users else 0
+    for uid in range(1, users + 1):
+        yield uid, min(round(rnd.expovariate(1 / mean)) if mean else 0, limit)
+
+
+def gen_users(n, reads_per_user, rnd):
+    for uid in range(1, n + 1):
+        xp = reads_per_user.get(uid, 0) * habit.READ_XP
+        yield (uid, str(TG_BASE + uid), f'load{uid}', f'Игрок {uid}', '',
+               1_000_000, xp, 1 + xp // 100, rnd.randrange(30))
+
+
+def gen_articles(n, rnd):
+    for aid in range(1, n + 1):
+        body = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randrange(150, 400)))
+        title = ' '.join(rnd.choice(WORDS) for _ in range(4)).capitalize()
+        yield (aid, f'{title} #{aid}', CATEGORIES[aid % len(CATEGORIES)], body.capitalize() + '.',
+               f'{rnd.randrange(2, 15)} мин', rnd.choice(WORDS))
+
+
+def gen_products(n, rnd):
+    for pid in range(1, n + 1):
+        kind = 'lootbox' if pid % 7 == 0 else 'booster'
+        yield (pid, f'Товар {pid}', 50 + 10 * rnd.randrange(100), '⚡', f'Описание {pid}', kind)
+
+
+def gen_pairs(counts, total_right):
+    # Пары (игрок, объект) без повторов: у игрока подряд идущие id с его смещения
+    for uid, k, start in counts:
+        for i in range(k):
+            yield (uid, (start + i) % total_right + 1)
+
+
+def gen_events(read_counts, articles, buy_counts, products, rnd, now):
+    # Журнал к тем же прочтениям и покупкам, в случайный момент за EVENT_DAYS дней.
+    # id событий не идут по времени, поэтому activity-rollup по такому
+    # журналу надо прогонять одной пачкой (--batch-size не меньше числа событий)
+    for kind, pairs in (('read', gen_pairs(read_counts, articles)), ('buy', gen_pairs(buy_counts, products))):
+        for uid, ref in pairs:
+            ts = time.gmtime(now - rnd.randrange(EVENT_DAYS * 86400))
+            yield uid, kind, ref, time.strftime('%Y-%m-%d %H:%M:%S', ts)
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_text(rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join('\\N' if v is None else str(v).replace('\\', '\\\\').replace('\t', ' ')
+                            .replace('\n', ' ') for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+def _load(conn, is_pg, table, rows):
+    columns = TABLES[table]
+    cols = ', '.join(f'"{c}"' for c in columns)
+    cur = conn.cursor()
+    n = 0
+    if is_pg:
+        for chunk in _chunks(rows):
+            cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN", _copy_text(chunk))
+            n += len(chunk)
+    else:
+        sql = f"INSERT INTO {table} ({cols}) VALUES ({', '.join('?' * len(columns))})"
+        for chunk in _chunks(rows):
+            cur.executemany(sql, chunk)
+            conn.commit()
+            n += len(chunk)
+    cur.close()
+    return n
+
+
+def connect(url, path):
+    if url:
+        import psycopg2
+        conn = psycopg2.connect(url)
+        conn.autocommit = True
+        return conn
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def migrate(url, path):
+    habit.app.config.update(DATABASE_URL=url, SQLITE_PATH=path)
+    with habit.app.app_context():
+        habit.init_db(seed=False)
+
+
+def generate(url, path, users, articles, reads, products, purchases, seed=1, reset=False, log=print):
+    """Наполняет базу; возвращает словарь с размерами и временем загрузки."""
+    migrate(url, path)
+    conn = connect(url, path)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM users")
+    if cur.fetchone()[0] and not reset:
+        raise SystemExit("База не пуста: добавьте --reset")
+    if reset:
+        for table in ('activity_events', 'purchases', 'user_reads', 'products', 'articles', 'users'):
+            cur.execute(f"TRUNCATE {table} RESTART IDENTITY" if url else f"DELETE FROM {table}")
+        if not url:
+            conn.commit()
+
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+    read_counts = [(uid, k, rnd.randrange(articles)) for uid, k in _per_user(reads, users, rnd, articles)]
+    buy_counts = [(uid, k, rnd.randrange(products)) for uid, k in _per_user(purchases, users, rnd, products)]
+    reads_per_user = {uid: k for uid, k, _ in read_counts}
+
+    sizes = {}
+    steps = (
+        ('users', gen_users(users, reads_per_user, rnd)),
+        ('articles', gen_articles(articles, rnd)),
+        ('products', gen_products(products, rnd)),
+        ('user_reads', ((u, a, True if url else 1) for u, a in gen_pairs(read_counts, articles))),
+        ('purchases', gen_pairs(buy_counts, products)),
+        ('activity_events', gen_events(read_counts, articles, buy_counts, products, rnd, int(time.time()) - 60)),
+    )
+    for table, rows in steps:
+        t = time.perf_counter()
+        sizes[table] = _load(conn, bool(url), table, rows)
+        log(f"📦 {table:<15} {sizes[table]:>12,} строк за {time.perf_counter() - t:6.1f} с")
+
+    if url:
+        # Явные id: счётчики SERIAL продолжаем после них
+        for table in ('users', 'articles', 'products'):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+        cur.execute("UPDATE job_watermarks SET watermark = 0")
+        cur.execute("ANALYZE")
+    else:
+        cur.execute("UPDATE job_watermarks SET watermark = 0")
+        cur.execute("ANALYZE")
+        conn.commit()
+    conn.close()
+    sizes['load_seconds'] = round(time.perf_counter() - started, 1)
+    sizes['seed'] = seed
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'переопределить {name} из --scale')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='очистить таблицы перед загрузкой')
+    args = parser.parse_args(argv)
+
+    scale = {k: getattr(args, k) if getattr(args, k) is not None else v for k, v in SCALES[args.scale].items()}
+    url = os.environ.get('BENCH_DATABASE_URL')
+    path = os.environ.get('SQLITE_PATH', 'habitmaster.db')
+    print(f"backend: {'postgres' if url else 'sqlite ' + path}, {scale}")
+    sizes = generate(url, path, seed=args.seed, reset=args.reset, **scale)
+    print(f"✅ Готово за {sizes['load_seconds']} с")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
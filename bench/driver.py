@@ -0,0 +1,247 @@
+"""HTTP-драйвер нагрузки: смешанный сценарий по всем основным маршрутам.
+
+    python -m bench.driver [--backends sqlite,postgres] [--scale small] [--clients 32] [--duration 30]
+    python -m bench.driver --compare bench/results/<старый>.json
+
+Для каждого бэкенда генерирует набор данных (bench.dataset), поднимает
+gunicorn и гоняет клиентов под подписанными initData игроков из набора по
+/home, /library, /shop, /stats, /api/read и /api/buy. Печатает пропускную
+способность и p50/p95/p99 по маршрутам и пишет всё в JSON
+(bench/results/<время>-<коммит>.json), чтобы сравнивать коммиты между собой.
+PostgreSQL берётся из BENCH_DATABASE_URL; без него бэкенд пропускается.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench import dataset
+from bench.server import ROOT, TOKEN, gunicorn
+from telegram_auth import TelegramAuth
+
+# Доли маршрутов в сценарии: чтение преобладает, как у живых игроков
+MIX = (
+    ('home', 15),
+    ('library', 25),
+    ('shop', 15),
+    ('stats', 10),
+    ('api_read', 25),
+    ('api_buy', 10),
+)
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+
+def percentile(sorted_values, q):
+    # Ближайший ранг: значение, ниже которого q доля наблюдений
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _request(route, rnd, sizes):
+    if route == 'home':
+        return 'GET', '/home'
+    if route == 'library':
+        pages = max(sizes['articles'] // 30, 1)
+        return 'GET', f'/library?page={min(1 + int(rnd.expovariate(0.5)), pages)}'
+    if route == 'shop':
+        return 'GET', '/shop'
+    if route == 'stats':
+        return 'GET', '/stats'
+    if route == 'api_read':
+        return 'POST', f'/api/read/{rnd.randint(1, sizes["articles"])}'
+    return 'POST', f'/api/buy/{rnd.randint(1, sizes["products"])}'
+
+
+def _client(base, n, seed, sizes, deadline, samples, lock):
+    rnd = random.Random(seed * 100_003 + n)
+    auth = TelegramAuth(TOKEN)
+    uid = rnd.randint(1, sizes['users'])
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    init = auth.sign({'id': dataset.TG_BASE + uid, 'first_name': f'Игрок {uid}'})
+    opener.open(base + '/?tgWebAppData=' + urllib.parse.quote(init), timeout=30).read()
+
+    routes = [r for r, _ in MIX]
+    weights = [w for _, w in MIX]
+    local = {r: ([], [0, 0]) for r in routes}  # маршрут -> (задержки, [отказы 4xx, ошибки])
+    while time.perf_counter() < deadline:
+        route = rnd.choices(routes, weights)[0]
+        method, path = _request(route, rnd, sizes)
+        req = urllib.request.Request(base + path, method=method, data=b'' if method == 'POST' else None)
+        start = time.perf_counter()
+        try:
+            opener.open(req, timeout=30).read()
+            local[route][0].append(time.perf_counter() - start)
+        except urllib.error.HTTPError as e:
+            # 4xx у /api/buy ("уже куплено") — штатный ответ, а не сбой
+            if e.code < 500:
+                local[route][0].append(time.perf_counter() - start)
+                local[route][1][0] += 1
+            else:
+                local[route][1][1] += 1
+        except OSError:
+            local[route][1][1] += 1
+    with lock:
+        for route, (latencies, (rejected, errors)) in local.items():
+            samples[route][0].extend(latencies)
+            samples[route][1][0] += rejected
+            samples[route][1][1] += errors
+
+
+def _summary(latencies, rejected, errors, elapsed):
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        'rejected_4xx': rejected,
+        'errors': errors,
+    }
+
+
+def run_backend(name, env, sizes, args):
+    with gunicorn(env, args.workers, args.async_mode) as (base, _):
+        samples = {r: ([], [0, 0]) for r, _ in MIX}
+        lock = threading.Lock()
+        # Прогрев: шаблоны, кэши и соединения до начала замера
+        warm_deadline = time.perf_counter() + args.warmup
+        warm = [threading.Thread(target=_client, args=(base, n, args.seed + 1, sizes, warm_deadline,
+                                                       {r: ([], [0, 0]) for r, _ in MIX}, lock))
+                for n in range(args.clients)]
+        for t in warm:
+            t.start()
+        for t in warm:
+            t.join()
+
+        deadline = time.perf_counter() + args.duration
+        pool = [threading.Thread(target=_client, args=(base, n, args.seed, sizes, deadline, samples, lock))
+                for n in range(args.clients)]
+        start = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+    routes = {r: _summary(lat, rej, err, elapsed) for r, (lat, (rej, err)) in samples.items()}
+    everything = [v for lat, _ in samples.values() for v in lat]
+    total = _summary(everything, sum(r['rejected_4xx'] for r in routes.values()),
+                     sum(r['errors'] for r in routes.values()), elapsed)
+    print(f"\n{name}: {total['rps']:,.0f} запросов/с, ошибок {total['errors']}")
+    print(f"  {'маршрут':<10} {'запр/с':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'4xx':>6} {'5xx':>5}")
+    for route, r in list(routes.items()) + [('всего', total)]:
+        print(f"  {route:<10} {r['rps']:>8,.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['rejected_4xx']:>6} {r['errors']:>5}")
+    return {'total': total, 'routes': routes}
+
+
+def _git(*cmd):
+    try:
+        return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(baseline_path, current, threshold):
+    """Печатает изменения относительно прошлого прогона; True, если есть регрессия."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline.get('commit', '?')[:10]} ({baseline_path}):")
+    regressed = False
+    for backend, result in current['backends'].items():
+        old = baseline.get('backends', {}).get(backend)
+        if not old:
+            continue
+        for route, r in list(result['routes'].items()) + [('всего', result['total'])]:
+            o = old['total'] if route == 'всего' else old['routes'].get(route)
+            if not o or not o['p95_ms'] or not o['rps']:
+                continue
+            d_p95 = (r['p95_ms'] - o['p95_ms']) / o['p95_ms']
+            d_rps = (r['rps'] - o['rps']) / o['rps']
+            flag = d_p95 > threshold or d_rps < -threshold
+            regressed |= flag
+            print(f"  {backend:<9} {route:<10} p95 {o['p95_ms']:>7.1f} -> {r['p95_ms']:>7.1f} мс ({d_p95:+6.1%})  "
+                  f"запр/с {o['rps']:>8.1f} -> {r['rps']:>8.1f} ({d_rps:+6.1%}){'  ⚠️' if flag else ''}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='sqlite,postgres')
+    parser.add_argument('--scale', choices=dataset.SCALES, default='small')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--async-mode', default='', help='ASYNC_MODE для gunicorn (например, gevent)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='не пересоздавать набор данных PostgreSQL')
+    parser.add_argument('--out', help='файл результатов (по умолчанию bench/results/<время>-<коммит>.json)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.10, help='порог регрессии p95/запр/с')
+    args = parser.parse_args(argv)
+
+    scale = dataset.SCALES[args.scale]
+    commit = _git('rev-parse', 'HEAD')
+    report = {
+        'commit': commit,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'dataset': scale,
+        'backends': {},
+    }
+
+    workdir = tempfile.mkdtemp()
+    for backend in args.backends.split(','):
+        env = dict(os.environ)
+        env.pop('DATABASE_URL', None)
+        if backend == 'postgres':
+            url = os.environ.get('BENCH_DATABASE_URL')
+            if not url:
+                print("\npostgres: пропущен, задайте BENCH_DATABASE_URL")
+                continue
+            env['DATABASE_URL'] = url
+            path = None
+        else:
+            url = None
+            path = env['SQLITE_PATH'] = os.path.join(workdir, 'habitmaster.db')
+        print(f"\n{backend}: набор данных {scale}")
+        if backend == 'postgres' and args.reuse:
+            sizes = dict(scale)
+        else:
+            sizes = dataset.generate(url, path, seed=args.seed, reset=True, log=lambda m: print('  ' + m), **scale)
+        result = run_backend(backend, env, scale, args)
+        result['load_seconds'] = sizes.get('load_seconds')
+        report['backends'][backend] = result
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit[:10] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📝 Результаты: {out}")
+
+    if args.compare and compare(args.compare, report, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
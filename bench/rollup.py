@@ -0,0 +1,54 @@
+"""activity-rollup: полный пересчёт журнала и догоняющий запуск.
+
+    python -m bench.rollup [масштаб] [новых событий]
+
+Наполняет базу через bench.dataset (large: 1M игроков и ~22M событий за
+30 дней), затем меряет activity.rollup() дважды: по всему журналу одной
+пачкой и после того, как N случайных игроков прочитали по статье сегодня —
+так задача работает по крону. SQLite — во временном файле, PostgreSQL —
+BENCH_DATABASE_URL.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import activity
+import app as habit
+from bench import dataset
+
+
+def _timed(cur, is_pg, **kwargs):
+    start = time.perf_counter()
+    stats = activity.rollup(cur, is_pg, habit.LEVEL_XP, lag=0, log=None, **kwargs)
+    return time.perf_counter() - start, stats
+
+
+def main(scale='medium', fresh=50_000):
+    url = os.environ.get('BENCH_DATABASE_URL')
+    path = None if url else os.path.join(tempfile.mkdtemp(), 'habitmaster.db')
+    sizes = dict(dataset.SCALES[scale])
+    print(f"backend: {'postgres' if url else 'sqlite ' + path}, {sizes}")
+    loaded = dataset.generate(url, path, reset=True, log=lambda m: print('  ' + m), **sizes)
+
+    conn = dataset.connect(url, path)
+    cur = conn.cursor()
+    events = loaded['activity_events']
+    elapsed, stats = _timed(cur, bool(url), batch_size=events)
+    print(f"полный   {elapsed:>7.2f} с  событий {events:,}, {stats}")
+
+    rnd = random.Random(2)
+    ph = '%s' if url else '?'
+    rows = [(rnd.randint(1, sizes['users']), rnd.randint(1, sizes['articles'])) for _ in range(fresh)]
+    cur.executemany(f"INSERT INTO activity_events (user_id, kind, ref_id) VALUES ({ph}, 'read', {ph})", rows)
+    if not url:
+        conn.commit()
+    elapsed, stats = _timed(cur, bool(url))
+    print(f"догоняющий {elapsed:>5.2f} с  событий {fresh:,}, {stats}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'medium',
+         int(sys.argv[2]) if len(sys.argv) > 2 else 50_000)
@@ -0,0 +1,87 @@
+"""Полнотекстовый поиск (/api/search) на большом корпусе статей.
+
+    python -m bench.search [статей] [повторов]
+
+Корпус грузится через importer: тексты из словаря с частотами по закону
+Ципфа, как в живом языке (у bench.dataset словарь из 18 слов, и каждое
+есть в каждой статье). Repository.search_articles меряется на словах
+разной частоты: редком, среднем, паре средних и самом частом — последний
+совпадает почти со всем корпусом, и первую страницу даёт ранжирование
+одних совпадений в названии и тегах.
+SQLite — во временном файле, PostgreSQL — BENCH_DATABASE_URL.
+"""
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+import app as habit
+import importer
+from bench import dataset
+
+PAGE = 21  # SEARCH_PAGE_SIZE + 1, как в /api/search
+VOCABULARY = 30_000
+SYLLABLES = ('ка', 'ро', 'ми', 'ту', 'ле', 'на', 'зо', 'пи', 'вы', 'ся', 'го', 'бу', 'ре', 'ча', 'до', 'ль')
+
+
+def vocabulary():
+    # Слова одной длины: ни одно не префикс другого, как и большинство
+    # словоформ настоящего текста. Порядок (= частота) перемешан
+    words = [''.join(p) for p in itertools.islice(itertools.product(SYLLABLES, repeat=4), VOCABULARY)]
+    random.Random(0).shuffle(words)
+    return words
+
+
+def articles(n, words, rnd):
+    cum = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+    for aid in range(1, n + 1):
+        body = rnd.choices(words, cum_weights=cum, k=rnd.randrange(150, 400))
+        yield (f'zipf-{aid}', ' '.join(body[:5]).capitalize(), dataset.CATEGORIES[aid % len(dataset.CATEGORIES)],
+               ' '.join(body[5:]).capitalize() + '.', '5 мин', ' '.join(body[:2]))
+
+
+def main(n=300_000, repeats=200):
+    url = os.environ.get('BENCH_DATABASE_URL')
+    path = None if url else os.path.join(tempfile.mkdtemp(), 'habitmaster.db')
+    print(f"backend: {'postgres' if url else 'sqlite ' + path}, статей: {n:,}")
+    dataset.migrate(url, path)
+    rnd = random.Random(1)
+    words = vocabulary()
+    conn = dataset.connect(url, path)
+    conn.cursor().execute("TRUNCATE articles RESTART IDENTITY" if url else "DELETE FROM articles")
+    if not url:
+        conn.commit()
+    importer.import_rows(conn, bool(url), 'articles', articles(n, words, rnd), chunk_size=20_000,
+                         log=lambda m: print('  ' + m) if m.startswith('✅') else None)
+    conn.cursor().execute("ANALYZE")
+    if not url:
+        conn.commit()
+    conn.close()
+
+    habit.app.config.update(DATABASE_URL=url, SQLITE_PATH=path)
+    habit.metrics.slow_query = float('inf')  # частые слова медленные заведомо, лог не нужен
+    kinds = {
+        'редкое': lambda: rnd.choice(words[10_000:]),
+        'среднее': lambda: rnd.choice(words[300:3_000]),
+        'два средних': lambda: ' '.join(rnd.sample(words[100:1_000], 2)),
+        'частое': lambda: rnd.choice(words[:5]),
+    }
+    with habit.app.app_context():
+        repo = habit.get_repo()
+        for kind, make in kinds.items():
+            times, found = [], 0
+            for i in range(repeats):
+                q, page = make(), 1 + i % 3
+                start = time.perf_counter()
+                found += len(repo.search_articles(1, q, PAGE, (page - 1) * (PAGE - 1)))
+                times.append(time.perf_counter() - start)
+            times.sort()
+            print(f"{kind:<12} p50 {times[len(times) // 2] * 1000:>8.2f} мс  "
+                  f"p95 {times[int(len(times) * 0.95)] * 1000:>8.2f} мс  в среднем найдено {found / repeats:.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200)
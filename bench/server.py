@@ -0,0 +1,94 @@
+"""Общие помощники бенчмарков: gunicorn на свободном порту, RSS, прокси с задержкой."""
+import asyncio
+import contextlib
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:bench-token'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def latency_proxy(url, delay):
+    # TCP-прокси перед PostgreSQL: каждый ответ сервера задерживается на delay
+    parts = urllib.parse.urlsplit(url)
+    host, port = parts.hostname, parts.port or 5432
+    listen = free_port()
+
+    async def pipe(reader, writer, pause):
+        try:
+            while data := await reader.read(65536):
+                if pause:
+                    await asyncio.sleep(pause)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_r, client_w):
+        server_r, server_w = await asyncio.open_connection(host, port)
+        await asyncio.gather(pipe(client_r, server_w, 0), pipe(server_r, client_w, delay))
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', listen)
+        await server.serve_forever()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    netloc = f"{parts.username}@127.0.0.1:{listen}" if parts.username else f"127.0.0.1:{listen}"
+    return urllib.parse.urlunsplit(parts._replace(netloc=netloc))
+
+
+def rss_kb(pid):
+    # RSS процесса и всех его потомков (воркеров gunicorn)
+    total = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        try:
+            with open(f'/proc/{p}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+            with open(f'/proc/{p}/task/{p}/children') as f:
+                pids.extend(int(c) for c in f.read().split())
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+def wait_ready(base, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base + '/api/health', timeout=1)
+            return
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn не поднялся')
+
+
+@contextlib.contextmanager
+def gunicorn(env, workers=2, mode=''):
+    """Запускает gunicorn app:app и отдаёт (базовый URL, процесс)."""
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(env, ASYNC_MODE=mode, BOT_TOKEN=TOKEN)
+    server = subprocess.Popen(['gunicorn', 'app:app', '-b', f'127.0.0.1:{port}', '-w', str(workers)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(base)
+        yield base, server
+    finally:
+        server.terminate()
+        server.wait()
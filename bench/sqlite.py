@@ -0,0 +1,86 @@
+"""SQLite: соединение на запрос против постоянных соединений с WAL.
+
+    python -m bench.sqlite [потоков] [секунд]
+
+Каждый поток — отдельный авторизованный игрок, который листает библиотеку,
+магазин и рейтинг и отмечает статьи прочитанными (запись в БД). Режимы
+запускаются по очереди на отдельных временных базах.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import app as habit
+
+ARTICLES = 2000
+
+
+def _setup(path, engine):
+    habit.app.config.update(DATABASE_URL=None, SQLITE_PATH=path, SQLITE_ENGINE=engine)
+    if habit._sqlite is not None:
+        habit._sqlite.closeall()
+    habit._sqlite = None
+    with habit.app.app_context():
+        habit.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO articles (category, title, content, read_time, tags) VALUES (?, ?, ?, '3 мин', '')",
+                     [(f'Раздел {i % 8}', f'Статья {i}', 'текст ' * 200) for i in range(ARTICLES)])
+    conn.commit()
+    ids = [r[0] for r in conn.execute("SELECT id FROM articles")]
+    conn.close()
+    return ids
+
+
+def _run(threads, seconds, article_ids):
+    counts = {'requests': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(n):
+        client = habit.app.test_client()
+        init = habit.telegram_auth.sign({'id': 10_000 + n, 'first_name': f'Bench {n}'})
+        client.get('/?tgWebAppData=' + urllib.parse.quote(init))
+        rnd = random.Random(n)
+        ids = article_ids[:]
+        rnd.shuffle(ids)
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            for method, url in (('get', f'/library?page={rnd.randint(1, 20)}'), ('post', f'/api/read/{ids[done % len(ids)]}'),
+                                ('get', '/shop'), ('post', f'/api/read/{ids[(done + 1) % len(ids)]}'), ('get', '/stats')):
+                resp = getattr(client, method)(url)
+                done += 1
+                errors += resp.status_code >= 500
+        with lock:
+            counts['requests'] += done
+            counts['errors'] += errors
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts, time.perf_counter() - start
+
+
+def main(threads=8, seconds=5.0):
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    for name, engine in (('соединение на запрос', False), ('SQLiteEngine (WAL)', True)):
+        path = os.path.join(workdir, f"{'engine' if engine else 'legacy'}.db")
+        ids = _setup(path, engine)
+        counts, elapsed = _run(threads, seconds, ids)
+        with sqlite3.connect(path) as conn:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        print(f"{name:<22} {counts['requests'] / elapsed:>9,.0f} запросов/с, ошибок {counts['errors']:>4} "
+              f"(journal_mode={mode}, {threads} потоков)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 5.0)
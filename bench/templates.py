@@ -0,0 +1,58 @@
+"""Рендер страниц: кэш скомпилированных шаблонов против компиляции на каждый запрос.
+
+    python -m bench.templates [итераций]
+"""
+import sys
+import time
+
+from flask import render_template, request, session
+from markupsafe import Markup
+
+from app import app
+
+USER = {'id': 1, 'telegram_id': '1', 'username': 'bench', 'first_name': 'Bench', 'photo_url': '',
+        'balance': 250, 'xp': 120, 'level': 2, 'streak': 3}
+ARTICLES = [{'id': i, 'title': f'Статья {i}', 'category': f'Категория {i % 3}', 'excerpt': 'Текст ' * 16,
+             'read_time': '5 мин', 'is_read': i % 2 == 0} for i in range(30)]
+CATEGORIES = {}
+for _art in ARTICLES:
+    CATEGORIES.setdefault(_art['category'], []).append(_art)
+ITEMS = [{'id': i, 'name': f'Товар {i}', 'price': 100 * i, 'icon': '⚡', 'desc': 'Описание', 'type': 'booster',
+          'bought': False, 'can_buy': True} for i in range(1, 4)]
+TOP = [{'first_name': f'Игрок {i}', 'xp': 1000 - i, 'level': 5, 'telegram_id': str(i)} for i in range(10)]
+
+PAGES = {
+    '/home': ('home.html', {'user': USER}),
+    # nav — готовый фрагмент, как из FragmentCache в app.library(); заполняется в main()
+    '/library': ('library.html', {'categories': CATEGORIES, 'total': 90, 'read_count': 15,
+                                  'page': 1, 'pages': 3, 'category': None, 'nav': None}),
+    '/shop': ('shop.html', {'items': ITEMS, 'user': USER}),
+    '/stats': ('stats.html', {'top': TOP, 'user': USER, 'rank': 42}),
+    '/profile': ('profile.html', {'user': USER, 'earned_ach': 0, 'total_ach': 5}),
+}
+
+
+def _timeit(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(n=500):
+    # Окружение без кэша шаблонов воспроизводит старое поведение:
+    # исходник страницы и base.html разбираются и компилируются на каждый запрос
+    uncached = app.jinja_env.overlay(cache_size=0)
+    with app.test_request_context('/library'):
+        nav = render_template('_library_nav.html', all_categories=sorted(CATEGORIES), category=None)
+    PAGES['/library'][1]['nav'] = Markup(nav)
+    print(f"{'route':<10} {'compile/req, мкс':>18} {'cached, мкс':>13} {'ускорение':>10}")
+    for path, (name, ctx) in PAGES.items():
+        with app.test_request_context(path):
+            cold = _timeit(lambda: uncached.get_template(name).render(request=request, session=session, **ctx), n)
+            warm = _timeit(lambda: render_template(name, **ctx), n)
+        print(f"{path:<10} {cold:>18.1f} {warm:>13.1f} {cold / warm:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
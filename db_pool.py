@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Пул исчерпан: свободное соединение не появилось за отведённое время."""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с ограниченным ожиданием.
+
+    connect     -- фабрика нового соединения
+    check       -- проверка живости соединения при выдаче (True = годно)
+    check_after -- проверять только соединения, простоявшие дольше N секунд
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0, check=None, check_after=30.0):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Некорректный размер пула: min={minconn}, max={maxconn}")
+        self._connect = connect
+        self._check = check
+        self._check_after = check_after
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+
+        # Метрики
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.discarded = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._new_conn(), time.monotonic()))
+
+    def _new_conn(self):
+        conn = self._connect()
+        self._open += 1
+        return conn
+
+    def _close_conn(self, conn):
+        self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _needs_check(self, idle_since):
+        return self._check is not None and time.monotonic() - idle_since >= self._check_after
+
+    def _healthy(self, conn):
+        try:
+            return self._check(conn)
+        except Exception:
+            return False
+
+    def getconn(self, wait=True):
+        # wait=False: не ждать освобождения, а вернуть None
+        deadline = None
+        while True:
+            with self._cond:
+                conn = None
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Пул соединений закрыт")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        # Место занято сразу: проверка идёт уже без блокировки
+                        self._in_use += 1
+                        if not self._needs_check(idle_since):
+                            self.checkouts += 1
+                            return conn
+                        break
+                    if self._open < self.maxconn:
+                        # Резервируем место до выхода из-под блокировки
+                        self._open += 1
+                        break
+                    if not wait:
+                        return None
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.timeout
+                        self.waits += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободных соединений с БД за {self.timeout:.1f} с "
+                            f"(занято {self._in_use}/{self.maxconn})"
+                        )
+                    started = now
+                    self._cond.wait(remaining)
+                    self.wait_time += time.monotonic() - started
+
+            if conn is None:
+                break
+            # Проверка живости — сетевой запрос; под блокировкой зависшее
+            # соединение остановило бы все getconn()/putconn() воркера
+            if self._healthy(conn):
+                with self._cond:
+                    self.checkouts += 1
+                return conn
+            with self._cond:
+                self._in_use -= 1
+                self._open -= 1
+                self.discarded += 1
+                self._cond.notify()
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self.discarded += 1
+                self._close_conn(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_conn(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max': self.maxconn,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+            }
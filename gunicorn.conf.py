@@ -0,0 +1,17 @@
+import os
+
+# gunicorn читает этот файл сам (Procfile: gunicorn app:app).
+# По умолчанию — прежние sync-воркеры; ASYNC_MODE=gevent включает gevent.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', '')
+
+if ASYNC_MODE == 'gevent':
+    worker_class = 'gevent'
+    # Одновременных запросов на воркер; соединений с БД при этом не больше DB_POOL_MAX
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    if ASYNC_MODE == 'gevent':
+        # psycopg2 ждёт ответа БД через хаб gevent, а не блокирует весь воркер
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+
+def tree_fingerprint(*dirs):
+    # Отпечаток шаблонов и статики: меняется с каждым деплоем, где они менялись
+    h = hashlib.md5()
+    for d in dirs:
+        for root, _, files in sorted(os.walk(d)):
+            for name in sorted(files):
+                with open(os.path.join(root, name), 'rb') as f:
+                    h.update(name.encode())
+                    h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class CatalogVersions:
+    """Версии каталогов (articles, products) из таблицы catalog_version.
+
+    Таблицу обновляют триггеры БД, поэтому версия общая для всех воркеров;
+    в процессе она кэшируется на ttl секунд.
+    """
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = None
+        self._expires = 0.0
+
+    def get(self, load):
+        # load() -> {имя каталога: версия}
+        with self._lock:
+            if self._versions is not None and time.monotonic() < self._expires:
+                return self._versions
+        versions = load()
+        with self._lock:
+            self._versions = versions
+            self._expires = time.monotonic() + self.ttl
+        return versions
+
+    def invalidate(self):
+        with self._lock:
+            self._versions = None
+
+
+class FragmentCache:
+    """LRU отрендеренных фрагментов; ключ включает версию каталога,
+    поэтому устаревшие записи просто вытесняются."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
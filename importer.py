@@ -0,0 +1,245 @@
+import csv
+import io
+import json
+import os
+import time
+
+# ==============================================================================
+# ИМПОРТ КОНТЕНТА
+# ==============================================================================
+# Статьи и товары загружаются потоком из JSONL, CSV или каталога Markdown с
+# front-matter (flask --app app import-content). Ключ — slug: повторный
+# импорт обновляет строки, а не дублирует их. Записи читаются по одной и
+# пишутся пачками: на SQLite — executemany, на PostgreSQL — COPY во
+# временную таблицу и один INSERT ... ON CONFLICT на пачку. Память не растёт
+# с размером файла. Каждая пачка — своя транзакция: оборванный импорт
+# безопасно запустить заново.
+
+FIELDS = {
+    'articles': ('slug', 'title', 'category', 'content', 'read_time', 'tags'),
+    'products': ('slug', 'name', 'price', 'icon', 'desc', 'type'),
+}
+REQUIRED = {
+    'articles': ('slug', 'title'),
+    'products': ('slug', 'name', 'price'),
+}
+INTEGER_FIELDS = {'price'}
+# Потолок поля CSV: у модуля csv по умолчанию 128 КБ, статья бывает длиннее
+CSV_FIELD_LIMIT = 64 * 1024 * 1024
+
+
+class ImportFormatError(ValueError):
+    """Запись не разобрать: в сообщении файл и строка."""
+
+
+# -- чтение -------------------------------------------------------------------
+# Каждый читатель отдаёт пары (место в файле, словарь полей)
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8-sig') as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ImportFormatError(f"{path}:{n}: {e}") from None
+            if not isinstance(record, dict):
+                raise ImportFormatError(f"{path}:{n}: ожидался объект JSON")
+            yield f"{path}:{n}", record
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        # Лимит общий на процесс: только поднимаем, чужой больший не трогаем
+        if csv.field_size_limit() < CSV_FIELD_LIMIT:
+            csv.field_size_limit(CSV_FIELD_LIMIT)
+        reader = csv.DictReader(f)
+        try:
+            for record in reader:
+                yield f"{path}:{reader.line_num}", record
+        except csv.Error as e:
+            # DictReader.line_num обновляется только после удачной записи
+            raise ImportFormatError(f"{path}:{reader.reader.line_num}: {e}") from None
+
+
+def parse_front_matter(text):
+    # Простой front-matter: строки "ключ: значение" между двумя "---"
+    meta = {}
+    if text.startswith('---'):
+        head, sep, body = text[3:].partition('\n---')
+        if sep:
+            for line in head.splitlines():
+                key, colon, value = line.partition(':')
+                if colon and key.strip():
+                    meta[key.strip()] = value.strip().strip('"\'')
+            text = body.partition('\n')[2]
+    return meta, text.strip()
+
+
+def read_markdown(path):
+    # Каталог *.md: slug по умолчанию — имя файла, content — текст после
+    # front-matter, title — из front-matter или первого заголовка "# "
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.md'):
+            continue
+        full = os.path.join(path, name)
+        with open(full, encoding='utf-8-sig') as f:
+            meta, body = parse_front_matter(f.read())
+        if 'title' not in meta and body.startswith('# '):
+            heading, _, body = body.partition('\n')
+            meta['title'] = heading[2:].strip()
+            body = body.strip()
+        meta.setdefault('slug', name[:-3])
+        meta.setdefault('content', body)
+        yield full, meta
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'markdown': read_markdown}
+
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return 'markdown'
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if ext == '.csv':
+        return 'csv'
+    raise ImportFormatError(f"{path}: формат не определить по расширению, укажите --format")
+
+
+def to_row(kind, record, where='запись'):
+    """Словарь полей -> кортеж в порядке FIELDS[kind]; лишние поля игнорируются."""
+    row = []
+    for field in FIELDS[kind]:
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ''):
+            if field in REQUIRED[kind]:
+                raise ImportFormatError(f"{where}: нет поля {field}")
+            value = None
+        elif field in INTEGER_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ImportFormatError(f"{where}: {field} должно быть целым, а не {value!r}") from None
+        elif isinstance(value, list):
+            value = ', '.join(str(v) for v in value)
+        else:
+            value = str(value)
+        row.append(value)
+    return tuple(row)
+
+
+def read_rows(kind, path, fmt=None):
+    for where, record in READERS[fmt or detect_format(path)](path):
+        yield to_row(kind, record, where)
+
+
+# -- запись -------------------------------------------------------------------
+def _columns(kind):
+    return ', '.join(f'"{c}"' for c in FIELDS[kind])
+
+
+def _upsert_set(kind):
+    return ', '.join(f'"{c}" = excluded."{c}"' for c in FIELDS[kind] if c != 'slug')
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_text(rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+class _SQLiteWriter:
+    def __init__(self, conn, kind):
+        self.cur = conn.cursor()
+        marks = ', '.join('?' * len(FIELDS[kind]))
+        self.sql = (f"INSERT INTO {kind} ({_columns(kind)}) VALUES ({marks}) "
+                    f"ON CONFLICT (slug) DO UPDATE SET {_upsert_set(kind)}")
+
+    def write(self, chunk):
+        self.cur.execute("BEGIN IMMEDIATE")
+        try:
+            self.cur.executemany(self.sql, chunk)
+            self.cur.execute("COMMIT")
+        except Exception:
+            self.cur.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.cur.close()
+
+
+class _PostgresWriter:
+    # COPY не умеет ON CONFLICT: пачка идёт во временную таблицу, оттуда —
+    # одним INSERT. Повторы slug внутри пачки схлопываются (побеждает
+    # последний), иначе ON CONFLICT DO UPDATE задел бы строку дважды.
+    def __init__(self, conn, kind):
+        self.cur = conn.cursor()
+        self.stage = f'import_{kind}'
+        columns = _columns(kind)
+        types = ', '.join(f'"{c}" {"INTEGER" if c in INTEGER_FIELDS else "TEXT"}' for c in FIELDS[kind])
+        self.cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {self.stage} (seq BIGSERIAL, {types})")
+        self.copy = f"COPY {self.stage} ({columns}) FROM STDIN"
+        # Новые строки получают id в порядке файла
+        self.merge = (f"INSERT INTO {kind} ({columns}) SELECT {columns} FROM ("
+                      f"SELECT DISTINCT ON (slug) seq, {columns} FROM {self.stage} ORDER BY slug, seq DESC"
+                      f") s ORDER BY seq ON CONFLICT (slug) DO UPDATE SET {_upsert_set(kind)}")
+
+    def write(self, chunk):
+        self.cur.execute("BEGIN")
+        try:
+            self.cur.copy_expert(self.copy, _copy_text(chunk))
+            self.cur.execute(self.merge)
+            self.cur.execute(f"TRUNCATE {self.stage}")
+            self.cur.execute("COMMIT")
+        except Exception:
+            self.cur.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.cur.execute(f"DROP TABLE IF EXISTS {self.stage}")
+        self.cur.close()
+
+
+def import_rows(conn, is_pg, kind, rows, chunk_size=5000, log=print):
+    """Пишет кортежи FIELDS[kind] пачками по chunk_size; возвращает число строк.
+
+    conn — соединение psycopg2 в autocommit или sqlite3 вне транзакции.
+    """
+    writer = (_PostgresWriter if is_pg else _SQLiteWriter)(conn, kind)
+    started = time.perf_counter()
+    total = 0
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write(chunk)
+                total += len(chunk)
+                chunk = []
+                if log:
+                    rate = total / (time.perf_counter() - started)
+                    log(f"📥 {kind}: {total:,} строк, {rate:,.0f} строк/с")
+        if chunk:
+            writer.write(chunk)
+            total += len(chunk)
+    finally:
+        writer.close()
+    if log:
+        elapsed = time.perf_counter() - started
+        log(f"✅ {kind}: {total:,} строк за {elapsed:.1f} с ({total / elapsed if elapsed else 0:,.0f} строк/с)")
+    return total
@@ -0,0 +1,87 @@
+import bisect
+import threading
+import time
+
+
+class Leaderboard:
+    """Топ игроков по XP с коротким кэшем в памяти процесса.
+
+    Запрос опирается на индекс users (xp DESC, id): топ читается как первые
+    N записей индекса. Место игрока считается по распределению XP (сколько
+    игроков с каждым значением): начисление XP переносит одного игрока из
+    корзины в корзину, а раз в sync_interval распределение перечитывается
+    из БД — так подтягиваются начисления других воркеров. Перечитывает один
+    запрос, остальные тем временем считают по прежней копии.
+    """
+
+    def __init__(self, size=10, ttl=10.0, sync_interval=60.0):
+        self.size = size
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._rows = None
+        self._expires = 0.0
+        self._sync_lock = threading.Lock()
+        self._xps = None      # различные значения XP по возрастанию
+        self._counts = None   # _counts[i] — игроков с XP = _xps[i]
+        self._synced = 0.0
+
+    def top(self, repo):
+        with self._lock:
+            if self._rows is not None and time.monotonic() < self._expires:
+                return self._rows
+        rows = repo.top(self.size)
+        with self._lock:
+            self._rows = rows
+            self._expires = time.monotonic() + self.ttl
+        return rows
+
+    def _sync(self, repo, wait):
+        # Один перечитывающий на процесс; без копии ждут его, с копией — нет
+        if not self._sync_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                if self._xps is not None and time.monotonic() < self._synced + self.sync_interval:
+                    return
+            rows = repo.xp_histogram()
+            with self._lock:
+                self._xps = [r[0] for r in rows]
+                self._counts = [r[1] for r in rows]
+                self._synced = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def rank(self, repo, xp):
+        # Место = 1 + игроки со строго большим XP; равные делят место
+        with self._lock:
+            missing = self._xps is None
+            stale = missing or time.monotonic() >= self._synced + self.sync_interval
+        if stale:
+            self._sync(repo, wait=missing)
+        with self._lock:
+            return 1 + sum(self._counts[bisect.bisect_right(self._xps, xp):])
+
+    def invalidate(self, histogram=True):
+        with self._lock:
+            self._rows = None
+            if histogram:
+                self._synced = 0.0
+
+    def xp_changed(self, old_xp, new_xp):
+        with self._lock:
+            # Игрок переходит из корзины old_xp в new_xp
+            if self._xps is not None:
+                i = bisect.bisect_left(self._xps, old_xp)
+                if i < len(self._xps) and self._xps[i] == old_xp and self._counts[i] > 0:
+                    self._counts[i] -= 1
+                i = bisect.bisect_left(self._xps, new_xp)
+                if i < len(self._xps) and self._xps[i] == new_xp:
+                    self._counts[i] += 1
+                else:
+                    self._xps.insert(i, new_xp)
+                    self._counts.insert(i, 1)
+            # Сбрасываем топ, только если игрок мог в него попасть
+            rows = self._rows
+            if rows is not None and (len(rows) < self.size or new_xp >= rows[-1].xp):
+                self._rows = None
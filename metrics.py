@@ -0,0 +1,218 @@
+import bisect
+import re
+import threading
+import time
+from collections import deque
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+INF = 'le="+Inf"'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: накопительные корзины, _sum и _count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [по корзинам..., sum, count]
+
+    def observe(self, labels, value):
+        # Вызывается под блокировкой Metrics
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for le, n in zip(self.buckets, series):
+                cumulative += n
+                bound = f'le="{le}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, INF)} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(series[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}"
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        for labels, value in sorted(self._series.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}"
+
+
+class RequestStats:
+    """Запросы к БД и время одного HTTP-запроса (или фоновой задачи)."""
+
+    __slots__ = ('metrics', 'endpoint', 'started', 'queries', 'db_time', 'render_started')
+
+    def __init__(self, metrics, endpoint):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_started = []
+
+    def query(self, sql, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed >= self.metrics.slow_query:
+            self.metrics.slow(self.endpoint, sql, elapsed)
+
+
+class TimedCursor:
+    """Обёртка курсора DB-API: время каждого execute идёт в RequestStats."""
+
+    __slots__ = ('_cur', '_stats')
+
+    def __init__(self, cur, stats):
+        self._cur = cur
+        self._stats = stats
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            if params is None:
+                self._cur.execute(sql)
+            else:
+                self._cur.execute(sql, params)
+        finally:
+            self._stats.query(sql, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq):
+        start = time.perf_counter()
+        try:
+            self._cur.executemany(sql, seq)
+        finally:
+            self._stats.query(sql, time.perf_counter() - start)
+        return self
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class Metrics:
+    """Метрики процесса в формате Prometheus.
+
+    Счётчики свои у каждого воркера gunicorn; Prometheus собирает их по
+    каждому воркеру отдельно и суммирует запросом.
+    """
+
+    def __init__(self, slow_query=0.1, slow_samples=50, prefix='habit'):
+        self.slow_query = slow_query
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._gauges = []  # (имя, справка, имена меток, функция -> {значения меток: число} или число)
+        self.requests = Counter(f'{prefix}_http_requests_total', 'HTTP-запросы по маршруту и статусу',
+                                ('endpoint', 'status'))
+        self.latency = Histogram(f'{prefix}_http_request_duration_seconds', 'Время обработки запроса',
+                                 ('endpoint',))
+        self.queries = Histogram(f'{prefix}_db_queries_per_request', 'Запросов к БД на один HTTP-запрос',
+                                 ('endpoint',), COUNT_BUCKETS)
+        self.db_time = Histogram(f'{prefix}_db_time_seconds', 'Суммарное время запросов к БД за HTTP-запрос',
+                                 ('endpoint',))
+        self.render = Histogram(f'{prefix}_template_render_seconds', 'Время рендера шаблона', ('template',))
+        self.slow_total = Counter(f'{prefix}_db_slow_queries_total', 'Запросы к БД дольше порога',
+                                  ('endpoint',))
+        self.slow_samples = deque(maxlen=slow_samples)  # (время, endpoint, sql, секунды)
+        self._families = (self.requests, self.latency, self.queries, self.db_time, self.render, self.slow_total)
+
+    def gauge(self, name, help, read, labelnames=()):
+        self._gauges.append((f'{self.prefix}_{name}', help, labelnames, read))
+
+    def request(self, endpoint):
+        return RequestStats(self, endpoint)
+
+    def finish(self, stats, status):
+        elapsed = time.perf_counter() - stats.started
+        labels = (stats.endpoint,)
+        with self._lock:
+            self.requests.inc((stats.endpoint, str(status)))
+            self.latency.observe(labels, elapsed)
+            self.queries.observe(labels, stats.queries)
+            self.db_time.observe(labels, stats.db_time)
+        return elapsed
+
+    def rendered(self, template, elapsed):
+        with self._lock:
+            self.render.observe((template,), elapsed)
+
+    def slow(self, endpoint, sql, elapsed):
+        sql = re.sub(r'\s+', ' ', sql).strip()
+        with self._lock:
+            self.slow_total.inc((endpoint,))
+            self.slow_samples.append((time.time(), endpoint, sql, elapsed))
+        print(f"🐢 Медленный запрос {elapsed * 1000:.0f} мс [{endpoint}]: {sql[:200]}")
+
+    def render_text(self):
+        lines = []
+        with self._lock:
+            for family in self._families:
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                lines.extend(family.render())
+            samples = list(self.slow_samples)
+        # Последние медленные запросы: секунды по тексту запроса (максимум из выборки)
+        worst = {}
+        for _, endpoint, sql, elapsed in samples:
+            key = (endpoint, sql[:200])
+            worst[key] = max(worst.get(key, 0.0), elapsed)
+        name = f'{self.prefix}_db_slow_query_seconds'
+        lines.append(f"# HELP {name} Последние медленные запросы (максимум по тексту)")
+        lines.append(f"# TYPE {name} gauge")
+        for (endpoint, sql), elapsed in sorted(worst.items()):
+            lines.append(f"{name}{_labels(('endpoint', 'query'), (endpoint, sql))} {elapsed!r}")
+        for name, help, labelnames, read in self._gauges:
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Metrics Error ({name}): {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, v in sorted(value.items()):
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_num(v)}")
+            else:
+                lines.append(f"{name} {_num(value)}")
+        return '\n'.join(lines) + '\n'
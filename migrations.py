@@ -0,0 +1,234 @@
+# ==============================================================================
+# МИГРАЦИИ СХЕМЫ
+# ==============================================================================
+# Схема поднимается один раз при деплое (flask --app app db-upgrade), а не при
+# старте воркеров. Каждая миграция — номер, имя и список выражений для
+# диалекта; применённые номера записываются в schema_migrations.
+# Миграции только добавляются: уже выпущенную не правим, пишем следующую.
+# Первая миграция идемпотентна (IF NOT EXISTS), чтобы базы, созданные
+# прежним init_db(), переводились на миграции без ручных шагов.
+
+def _sqlite_version_triggers():
+    return [f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table} BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE name = '{table}';
+                END"""
+            for table in ('articles', 'products') for event in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+def _pg_version_triggers():
+    statements = ["""CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+                     BEGIN
+                         UPDATE catalog_version SET version = version + 1 WHERE name = TG_ARGV[0];
+                         RETURN NULL;
+                     END $$ LANGUAGE plpgsql"""]
+    for table in ('articles', 'products'):
+        statements.append(f"DROP TRIGGER IF EXISTS trg_{table}_version ON {table}")
+        statements.append(f"""CREATE TRIGGER trg_{table}_version AFTER INSERT OR UPDATE OR DELETE ON {table}
+                              FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('{table}')""")
+    return statements
+
+
+MIGRATIONS = [
+    (1, 'initial schema', {
+        'postgres': [
+            """CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY, telegram_id TEXT UNIQUE, username TEXT,
+                first_name TEXT, photo_url TEXT, balance INTEGER DEFAULT 100,
+                xp INTEGER DEFAULT 0, level INTEGER DEFAULT 1, streak INTEGER DEFAULT 0
+            )""",
+            """CREATE TABLE IF NOT EXISTS articles (
+                id SERIAL PRIMARY KEY, title TEXT, category TEXT, content TEXT,
+                read_time TEXT, tags TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS user_reads (
+                user_id INTEGER, article_id INTEGER, is_read BOOLEAN DEFAULT FALSE,
+                PRIMARY KEY (user_id, article_id)
+            )""",
+            """CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY, name TEXT, price INTEGER, icon TEXT, "desc" TEXT, type TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS purchases (
+                user_id INTEGER, product_id INTEGER, PRIMARY KEY (user_id, product_id)
+            )""",
+            """CREATE TABLE IF NOT EXISTS catalog_version (
+                name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0
+            )""",
+            *_pg_version_triggers(),
+            "INSERT INTO catalog_version (name) VALUES ('articles'), ('products') ON CONFLICT DO NOTHING",
+        ],
+        'sqlite': [
+            """CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id TEXT UNIQUE, username TEXT,
+                first_name TEXT, photo_url TEXT, balance INTEGER DEFAULT 100,
+                xp INTEGER DEFAULT 0, level INTEGER DEFAULT 1, streak INTEGER DEFAULT 0
+            )""",
+            """CREATE TABLE IF NOT EXISTS articles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, category TEXT, content TEXT,
+                read_time TEXT, tags TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS user_reads (
+                user_id INTEGER, article_id INTEGER, is_read BOOLEAN DEFAULT 0,
+                PRIMARY KEY (user_id, article_id)
+            )""",
+            """CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, price INTEGER, icon TEXT, desc TEXT, type TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS purchases (
+                user_id INTEGER, product_id INTEGER, PRIMARY KEY (user_id, product_id)
+            )""",
+            """CREATE TABLE IF NOT EXISTS catalog_version (
+                name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0
+            )""",
+            *_sqlite_version_triggers(),
+            "INSERT INTO catalog_version (name) VALUES ('articles'), ('products') ON CONFLICT DO NOTHING",
+        ],
+    }),
+    # Индексы горячих запросов. purchases(user_id) и user_reads(user_id)
+    # отдельно не нужны: их покрывает префикс первичного ключа (user_id, ...).
+    (2, 'hot path indexes', {
+        'common': [
+            # Топ-10 и место игрока в /stats: ORDER BY xp DESC, id
+            "CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC, id)",
+            # Библиотека: WHERE category = ? ORDER BY id и ORDER BY category, id
+            "CREATE INDEX IF NOT EXISTS idx_articles_category ON articles (category, id)",
+        ],
+    }),
+    # Внешний ключ контента для import-content: upsert по slug. У строк,
+    # созданных до миграции, slug пустой (NULL уникальности не мешает).
+    (3, 'content slugs', {
+        'common': [
+            "ALTER TABLE articles ADD COLUMN slug TEXT",
+            "ALTER TABLE products ADD COLUMN slug TEXT",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_articles_slug ON articles (slug)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_products_slug ON products (slug)",
+        ],
+    }),
+    # Полнотекстовый поиск по title, tags и content (/api/search). На
+    # PostgreSQL — вычисляемая колонка tsvector с весами и GIN-индекс, на
+    # SQLite — внешняя FTS5-таблица, которую синхронизируют триггеры.
+    (4, 'article search', {
+        'postgres': [
+            """ALTER TABLE articles ADD COLUMN search tsvector GENERATED ALWAYS AS (
+                   setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                   setweight(to_tsvector('russian', coalesce(tags, '')), 'B') ||
+                   setweight(to_tsvector('russian', coalesce(content, '')), 'C')
+               ) STORED""",
+            "CREATE INDEX idx_articles_search ON articles USING GIN (search)",
+        ],
+        'sqlite': [
+            """CREATE VIRTUAL TABLE articles_fts USING fts5(
+                   title, content, tags, content='articles', content_rowid='id',
+                   tokenize='unicode61 remove_diacritics 2'
+               )""",
+            """CREATE TRIGGER trg_articles_fts_insert AFTER INSERT ON articles BEGIN
+                   INSERT INTO articles_fts (rowid, title, content, tags)
+                   VALUES (new.id, new.title, new.content, new.tags);
+               END""",
+            """CREATE TRIGGER trg_articles_fts_delete AFTER DELETE ON articles BEGIN
+                   INSERT INTO articles_fts (articles_fts, rowid, title, content, tags)
+                   VALUES ('delete', old.id, old.title, old.content, old.tags);
+               END""",
+            """CREATE TRIGGER trg_articles_fts_update AFTER UPDATE OF title, content, tags ON articles BEGIN
+                   INSERT INTO articles_fts (articles_fts, rowid, title, content, tags)
+                   VALUES ('delete', old.id, old.title, old.content, old.tags);
+                   INSERT INTO articles_fts (rowid, title, content, tags)
+                   VALUES (new.id, new.title, new.content, new.tags);
+               END""",
+            "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        ],
+    }),
+    # Журнал активности только дописывается; серии и уровни по нему считает
+    # activity-rollup, продолжая с отметки в job_watermarks.
+    (5, 'activity events', {
+        'postgres': [
+            """CREATE TABLE activity_events (
+                id BIGSERIAL PRIMARY KEY, user_id INTEGER NOT NULL, kind TEXT NOT NULL,
+                ref_id INTEGER, created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+        ],
+        'sqlite': [
+            # AUTOINCREMENT: id не переиспользуются, отметка по id не пропустит событий
+            """CREATE TABLE activity_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, kind TEXT NOT NULL,
+                ref_id INTEGER, created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+        ],
+        'common': [
+            """CREATE TABLE job_watermarks (
+                name TEXT PRIMARY KEY, watermark BIGINT NOT NULL DEFAULT 0
+            )""",
+            "INSERT INTO job_watermarks (name) VALUES ('activity_rollup')",
+            # День последней активности, по которому продолжается серия
+            "ALTER TABLE users ADD COLUMN last_active DATE",
+            # Сброс прерванных серий: только игроки с ненулевой серией
+            "CREATE INDEX idx_users_streak ON users (last_active) WHERE streak > 0",
+        ],
+    }),
+    # Первый уровень выдачи поиска — совпадения в названии и тегах. На
+    # PostgreSQL для него отдельный маленький tsvector без текста статьи:
+    # его ранжирование не читает TOAST. На SQLite хватает фильтра колонок FTS5.
+    (6, 'article search head', {
+        'postgres': [
+            """ALTER TABLE articles ADD COLUMN search_head tsvector GENERATED ALWAYS AS (
+                   setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                   setweight(to_tsvector('russian', coalesce(tags, '')), 'B')
+               ) STORED""",
+            "CREATE INDEX idx_articles_search_head ON articles USING GIN (search_head)",
+        ],
+    }),
+]
+
+# Сериализует параллельные db-upgrade на PostgreSQL (несколько release-задач)
+_PG_LOCK_ID = 727100
+
+
+def _ensure_table(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY, name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+
+def applied_versions(cur):
+    _ensure_table(cur)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {r[0] for r in cur.fetchall()}
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def upgrade(cur, is_pg, target=None, log=print):
+    """Применяет недостающие миграции до target (по умолчанию — все).
+
+    Каждая миграция идёт в своей транзакции вместе с записью в
+    schema_migrations. Возвращает список применённых номеров.
+    """
+    dialect = 'postgres' if is_pg else 'sqlite'
+    ph = '%s' if is_pg else '?'
+    _ensure_table(cur)
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        cur.execute("BEGIN" if is_pg else "BEGIN IMMEDIATE")
+        try:
+            if is_pg:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (_PG_LOCK_ID,))
+            # Проверка внутри транзакции: параллельный запуск мог успеть раньше
+            cur.execute(f"SELECT 1 FROM schema_migrations WHERE version = {ph}", (version,))
+            if cur.fetchone():
+                cur.execute("ROLLBACK")
+                continue
+            for sql in statements.get('common', []) + statements.get(dialect, []):
+                cur.execute(sql)
+            cur.execute(f"INSERT INTO schema_migrations (version, name) VALUES ({ph}, {ph})", (version, name))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        log(f"🧱 Миграция {version:03d}: {name}")
+        applied.append(version)
+    return applied
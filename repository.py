@@ -0,0 +1,356 @@
+import re
+from collections import namedtuple
+
+# ==============================================================================
+# ЗАПИСИ
+# ==============================================================================
+# Строки возвращаются одинаковыми на SQLite и PostgreSQL, доступ по имени поля.
+User = namedtuple('User', 'id telegram_id username first_name photo_url balance xp level streak')
+ArticleCard = namedtuple('ArticleCard', 'id title category read_time excerpt is_read')
+Article = namedtuple('Article', 'id title category read_time content')
+Product = namedtuple('Product', 'id name price icon desc type')
+Leader = namedtuple('Leader', 'first_name xp level telegram_id')
+
+BUY_OK, BUY_NOT_FOUND, BUY_OWNED, BUY_NO_FUNDS = 'ok', 'not_found', 'owned', 'no_funds'
+# Виды записей журнала activity_events (из него activity.rollup() считает серии)
+EVENT_READ, EVENT_BUY = 'read', 'buy'
+
+# ==============================================================================
+# ЗАПРОСЫ
+# ==============================================================================
+# Каждый запрос записан один раз с плейсхолдерами '?'. Для PostgreSQL текст
+# переводится один раз на процесс: в '%s' для обычного выполнения или в
+# '$1..$n' для PREPARE. Внутри строковых литералов '?' не использовать.
+STATEMENTS = {
+    'user_by_id': "SELECT id, telegram_id, username, first_name, photo_url, balance, xp, level, streak "
+                  "FROM users WHERE id = ?",
+    'user_id_by_telegram': "SELECT id FROM users WHERE telegram_id = ?",
+    'upsert_user': """INSERT INTO users (telegram_id, username, first_name, photo_url, balance, xp, level)
+                      VALUES (?, ?, ?, ?, 100, 0, 1)
+                      ON CONFLICT (telegram_id) DO UPDATE SET username = excluded.username,
+                          first_name = excluded.first_name, photo_url = excluded.photo_url
+                      RETURNING id""",
+    'read_count': "SELECT count(*) FROM user_reads WHERE user_id = ?",
+    'article_count': "SELECT count(*) FROM articles",
+    'article_count_in': "SELECT count(*) FROM articles WHERE category = ?",
+    'categories': "SELECT DISTINCT category FROM articles ORDER BY category",
+    'article_page': """SELECT a.id, a.title, a.category, a.read_time, substr(a.content, 1, 100),
+                              r.article_id IS NOT NULL
+                       FROM articles a
+                       LEFT JOIN user_reads r ON r.user_id = ? AND r.article_id = a.id
+                       ORDER BY a.category, a.id LIMIT ? OFFSET ?""",
+    'article_page_in': """SELECT a.id, a.title, a.category, a.read_time, substr(a.content, 1, 100),
+                                 r.article_id IS NOT NULL
+                          FROM articles a
+                          LEFT JOIN user_reads r ON r.user_id = ? AND r.article_id = a.id
+                          WHERE a.category = ?
+                          ORDER BY a.id LIMIT ? OFFSET ?""",
+    # Поиск в два уровня: сначала совпадения в названии и тегах, затем
+    # совпадения только в тексте; внутри уровня — по релевантности.
+    # Ранжируются все совпадения, но второй уровень считается, только если
+    # страница до него дошла (UNION ALL под LIMIT). Статус прочтения
+    # достраивается только для строк страницы
+    'search_articles_pg': """WITH q AS (SELECT to_tsquery('russian', ?) AS q),
+                                  f AS ((SELECT id, 1 AS tier, ts_rank(search_head, q.q) AS score
+                                         FROM articles, q WHERE search_head @@ q.q
+                                         ORDER BY score DESC, id)
+                                        UNION ALL
+                                        (SELECT id, 0 AS tier, ts_rank(search, q.q) AS score
+                                         FROM articles, q WHERE search @@ q.q AND NOT search_head @@ q.q
+                                         ORDER BY score DESC, id)
+                                        LIMIT ? OFFSET ?)
+                             SELECT a.id, a.title, a.category, a.read_time, substr(a.content, 1, 100),
+                                    r.article_id IS NOT NULL
+                             FROM f
+                             JOIN articles a ON a.id = f.id
+                             LEFT JOIN user_reads r ON r.user_id = ? AND r.article_id = a.id
+                             ORDER BY f.tier DESC, f.score DESC, a.id""",
+    'search_articles_sqlite': """SELECT a.id, a.title, a.category, a.read_time, substr(a.content, 1, 100),
+                                        r.article_id IS NOT NULL
+                                 FROM (SELECT * FROM (SELECT rowid AS id, 1 AS tier, bm25(articles_fts, 10.0, 1.0, 4.0) AS score
+                                                      FROM articles_fts WHERE articles_fts MATCH ?
+                                                      ORDER BY score, rowid)
+                                       UNION ALL
+                                       SELECT * FROM (SELECT rowid AS id, 0 AS tier, bm25(articles_fts, 10.0, 1.0, 4.0) AS score
+                                                      FROM articles_fts WHERE articles_fts MATCH ?
+                                                      ORDER BY score, rowid)
+                                       LIMIT ? OFFSET ?) f
+                                 JOIN articles a ON a.id = f.id
+                                 LEFT JOIN user_reads r ON r.user_id = ? AND r.article_id = a.id
+                                 ORDER BY f.tier DESC, f.score, a.id""",
+    'article': "SELECT id, title, category, read_time, content FROM articles WHERE id = ?",
+    'article_exists': "SELECT 1 FROM articles WHERE id = ?",
+    'products': 'SELECT id, name, price, icon, "desc", type FROM products ORDER BY id',
+    'product': 'SELECT id, name, price, icon, "desc", type FROM products WHERE id = ?',
+    'purchase_count': "SELECT count(*) FROM purchases WHERE user_id = ?",
+    'purchased_ids': "SELECT product_id FROM purchases WHERE user_id = ?",
+    'insert_read': """INSERT INTO user_reads (user_id, article_id, is_read)
+                      SELECT CAST(? AS INTEGER), id, TRUE FROM articles WHERE id = ?
+                      ON CONFLICT (user_id, article_id) DO NOTHING""",
+    'insert_event': "INSERT INTO activity_events (user_id, kind, ref_id) VALUES (?, ?, ?)",
+    # Уровень пишется вместе с XP: страницы и API сразу видят одно значение
+    'credit_user': """UPDATE users SET xp = xp + ?, balance = balance + ?, level = 1 + (xp + ?) / ?
+                     WHERE id = ? RETURNING xp""",
+    'add_rewards': "UPDATE users SET xp = xp + ?, balance = balance + ?, level = 1 + (xp + ?) / ? WHERE id = ?",
+    'insert_purchase': """INSERT INTO purchases (user_id, product_id)
+                          SELECT CAST(? AS INTEGER), id FROM products WHERE id = ?
+                          ON CONFLICT DO NOTHING""",
+    'debit_purchase': """UPDATE users SET balance = users.balance - p.price
+                             + CASE WHEN p.type = 'lootbox' THEN CAST(? AS INTEGER) ELSE 0 END
+                         FROM products p
+                         WHERE users.id = ? AND p.id = ? AND users.balance >= p.price
+                         RETURNING users.balance""",
+    'top': "SELECT first_name, xp, level, telegram_id FROM users ORDER BY xp DESC, id LIMIT ?",
+    'xp_histogram': "SELECT xp, count(*) FROM users WHERE xp IS NOT NULL GROUP BY xp ORDER BY xp",
+    'catalog_versions': "SELECT name, version FROM catalog_version",
+    'demo_user_ids': "SELECT id FROM users WHERE telegram_id LIKE 'demo!_%' ESCAPE '!' ORDER BY id LIMIT ?",
+}
+
+# Не больше стольких слов из поисковой строки
+SEARCH_MAX_TERMS = 8
+SEARCH_MIN_PREFIX = 3
+
+
+def search_terms(text):
+    # Из пользовательского ввода берутся только слова: синтаксис MATCH и
+    # to_tsquery в него не попадает
+    return re.findall(r'\w+', text.lower())[:SEARCH_MAX_TERMS]
+
+
+_pg_text = {}
+_pg_numbered = {}
+
+
+def _translate(sql, numbered):
+    parts = sql.split('?')
+    if numbered:
+        return ''.join(p + (f'${i}' if i < len(parts) else '') for i, p in enumerate(parts, 1))
+    # Литеральный '%' для psycopg2 нужно удвоить
+    return '%s'.join(p.replace('%', '%%') for p in parts)
+
+
+def pg_text(name):
+    sql = _pg_text.get(name)
+    if sql is None:
+        sql = _pg_text[name] = _translate(STATEMENTS[name], numbered=False)
+    return sql
+
+
+def pg_numbered(name):
+    sql = _pg_numbered.get(name)
+    if sql is None:
+        sql = _pg_numbered[name] = _translate(STATEMENTS[name], numbered=True)
+    return sql
+
+
+def make_pg_connection_class():
+    # Соединение psycopg2, которое помнит свои серверные prepared statements
+    import psycopg2.extensions
+
+    class PreparedConnection(psycopg2.extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+
+    return PreparedConnection
+
+
+# ==============================================================================
+# РЕПОЗИТОРИЙ
+# ==============================================================================
+class Repository:
+    """Все обращения маршрутов к БД: по одному методу на операцию.
+
+    На PostgreSQL запросы выполняются через PREPARE/EXECUTE, если соединение
+    создано с PreparedConnection; на SQLite одинаковый текст запроса попадает
+    в кэш подготовленных выражений модуля sqlite3.
+    """
+
+    def __init__(self, conn, is_pg, cursor=None):
+        self.conn = conn
+        self.is_pg = is_pg
+        self.ph = '%s' if is_pg else '?'
+        self.cur = conn.cursor() if cursor is None else cursor
+        self._prepared = getattr(conn, 'prepared', None) if is_pg else None
+
+    def close(self):
+        self.cur.close()
+
+    def _execute(self, name, params=()):
+        cur = self.cur
+        if self._prepared is not None:
+            if name not in self._prepared:
+                cur.execute(f"PREPARE {name} AS {pg_numbered(name)}")
+                self._prepared.add(name)
+            if params:
+                cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cur.execute(f"EXECUTE {name}")
+        elif self.is_pg:
+            cur.execute(pg_text(name), params)
+        else:
+            cur.execute(STATEMENTS[name], params)
+        return cur
+
+    def _one(self, name, params=()):
+        return self._execute(name, params).fetchone()
+
+    def _scalar(self, name, params=()):
+        row = self._one(name, params)
+        return row[0] if row else None
+
+    def begin(self):
+        self.cur.execute("BEGIN" if self.is_pg else "BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.cur.execute("COMMIT")
+
+    def rollback(self):
+        self.cur.execute("ROLLBACK")
+
+    # -- пользователи ---------------------------------------------------------
+    def get_user(self, uid):
+        row = self._one('user_by_id', (uid,))
+        return User._make(row) if row else None
+
+    def user_id_by_telegram(self, telegram_id):
+        return self._scalar('user_id_by_telegram', (telegram_id,))
+
+    def upsert_user(self, telegram_id, username, first_name, photo_url):
+        uid = self._scalar('upsert_user', (telegram_id, username, first_name, photo_url))
+        if not self.is_pg:
+            self.conn.commit()
+        return uid
+
+    # -- библиотека -----------------------------------------------------------
+    def read_count(self, uid):
+        return self._scalar('read_count', (uid,))
+
+    def count_articles(self, category=None):
+        if category is None:
+            return self._scalar('article_count')
+        return self._scalar('article_count_in', (category,))
+
+    def categories(self):
+        return [r[0] for r in self._execute('categories').fetchall()]
+
+    def list_articles(self, uid, category=None, limit=30, offset=0):
+        # Итератор по курсору, без промежуточного списка
+        if category is None:
+            cur = self._execute('article_page', (uid, limit, offset))
+        else:
+            cur = self._execute('article_page_in', (uid, category, limit, offset))
+        for row in cur:
+            yield ArticleCard(row[0], row[1], row[2], row[3], row[4], bool(row[5]))
+
+    def get_article(self, aid):
+        row = self._one('article', (aid,))
+        return Article._make(row) if row else None
+
+    def article_exists(self, aid):
+        return self._one('article_exists', (aid,)) is not None
+
+    def search_articles(self, uid, text, limit=20, offset=0):
+        # Все слова должны встретиться. Последнее — префикс (строку ещё
+        # набирают), но не короче SEARCH_MIN_PREFIX: префикс из пары букв
+        # совпадает с тысячами слов и читает половину индекса
+        terms = search_terms(text)
+        if not terms:
+            return []
+        prefix = len(terms[-1]) >= SEARCH_MIN_PREFIX
+        if self.is_pg:
+            query = ' & '.join(terms) + (':*' if prefix else '')
+            cur = self._execute('search_articles_pg', (query, limit, offset, uid))
+        else:
+            query = ' '.join(f'"{t}"' for t in terms) + ('*' if prefix else '')
+            head = f'{{title tags}} : ({query})'
+            cur = self._execute('search_articles_sqlite', (head, f'({query}) NOT ({head})', limit, offset, uid))
+        return [ArticleCard(r[0], r[1], r[2], r[3], r[4], bool(r[5])) for r in cur.fetchall()]
+
+    def record_read(self, uid, aid, xp, coins, level_xp, defer=False):
+        # Награда только за первое прочтение существующей статьи; с defer
+        # пишется лишь факт прочтения, начисление делает вызывающий.
+        # Возвращает (засчитано ли, новый XP или None).
+        self.begin()
+        try:
+            if self._execute('insert_read', (uid, aid)).rowcount != 1:
+                self.rollback()
+                return False, None
+            new_xp = None if defer else self._scalar('credit_user', (xp, coins, xp, level_xp, uid))
+            self._execute('insert_event', (uid, EVENT_READ, aid))
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return True, new_xp
+
+    def add_rewards(self, batch, level_xp):
+        # batch: [(xp, coins, user_id), ...] одной транзакцией
+        sql = pg_text('add_rewards') if self.is_pg else STATEMENTS['add_rewards']
+        self.begin()
+        try:
+            self.cur.executemany(sql, [(xp, coins, xp, level_xp, uid) for xp, coins, uid in batch])
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+
+    # -- магазин --------------------------------------------------------------
+    def list_products(self):
+        return [Product._make(r) for r in self._execute('products').fetchall()]
+
+    def get_product(self, pid):
+        row = self._one('product', (pid,))
+        return Product._make(row) if row else None
+
+    def purchase_count(self, uid):
+        return self._scalar('purchase_count', (uid,))
+
+    def purchased_ids(self, uid):
+        return {r[0] for r in self._execute('purchased_ids', (uid,)).fetchall()}
+
+    def purchase(self, uid, pid, lootbox_bonus):
+        # Покупка одной транзакцией: запись в purchases (уникальный ключ
+        # отсекает двойной клик), затем условное списание с бонусом по
+        # products.type. Возвращает (статус, новый баланс из БД).
+        self.begin()
+        try:
+            if self._execute('insert_purchase', (uid, pid)).rowcount != 1:
+                self.rollback()
+                return (BUY_OWNED if self.get_product(pid) else BUY_NOT_FOUND), None
+            row = self._one('debit_purchase', (lootbox_bonus, uid, pid))
+            if row is None:
+                self.rollback()
+                return BUY_NO_FUNDS, None
+            self._execute('insert_event', (uid, EVENT_BUY, pid))
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return BUY_OK, row[0]
+
+    # -- рейтинг и каталог ----------------------------------------------------
+    def top(self, limit):
+        return [Leader._make(r) for r in self._execute('top', (limit,)).fetchall()]
+
+    def xp_histogram(self):
+        # [(xp, игроков с таким xp)] по возрастанию xp: один проход по idx_users_xp
+        return self._execute('xp_histogram').fetchall()
+
+    def catalog_versions(self):
+        return dict(self._execute('catalog_versions').fetchall())
+
+    # -- обслуживание ---------------------------------------------------------
+    def delete_demo_users(self, batch_size):
+        self.begin()
+        try:
+            ids = [r[0] for r in self._execute('demo_user_ids', (batch_size,)).fetchall()]
+            if ids:
+                marks = ', '.join([self.ph] * len(ids))
+                for table, column in (('user_reads', 'user_id'), ('purchases', 'user_id'), ('users', 'id')):
+                    self.cur.execute(f"DELETE FROM {table} WHERE {column} IN ({marks})", ids)
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return len(ids)
@@ -0,0 +1,100 @@
+import atexit
+import threading
+
+
+class RewardBuffer:
+    """Отложенная запись наград (write-behind).
+
+    Дельты XP и монет копятся в памяти по user_id и сбрасываются одной
+    пачкой: по таймеру, при достижении max_pending игроков и при выходе
+    процесса. flush_fn получает список (xp, coins, user_id). Пачка, которая
+    пишется прямо сейчас, до COMMIT остаётся видна в pending().
+    """
+
+    def __init__(self, flush_fn, interval=2.0, max_pending=500):
+        self._flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._inflight = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        # Метрики
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reward-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def add(self, uid, xp, coins):
+        with self._lock:
+            delta = self._pending.get(uid)
+            if delta is None:
+                self._pending[uid] = [xp, coins]
+            else:
+                delta[0] += xp
+                delta[1] += coins
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def pending(self, uid):
+        # Ещё не записанные (xp, coins) игрока: ответы API прибавляют их к строке users
+        with self._lock:
+            xp = coins = 0
+            for deltas in (self._pending, self._inflight):
+                delta = deltas.get(uid)
+                if delta:
+                    xp, coins = xp + delta[0], coins + delta[1]
+            return xp, coins
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._inflight, self._pending = self._pending, {}
+            return self._write()
+
+    def flush_user(self, uid):
+        # Синхронно записывает дельту одного игрока: например, перед покупкой,
+        # чтобы проверка баланса в БД видела монеты за прочтения
+        with self._flush_lock:
+            with self._lock:
+                delta = self._pending.pop(uid, None)
+                if delta is not None:
+                    self._inflight = {uid: delta}
+            return self._write() if delta is not None else 0
+
+    def _write(self):
+        # Вызывается под _flush_lock: пишет _inflight и убирает его из pending()
+        if not self._inflight:
+            return 0
+        batch = [(xp, coins, uid) for uid, (xp, coins) in self._inflight.items()]
+        try:
+            self._flush_fn(batch)
+        except Exception as e:
+            print(f"Reward Flush Error: {e}")
+            self.errors += 1
+            # Возвращаем дельты, чтобы не потерять их до следующей попытки
+            with self._lock:
+                self._inflight = {}
+            for xp, coins, uid in batch:
+                self.add(uid, xp, coins)
+            return 0
+        with self._lock:
+            self._inflight = {}
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+import weakref
+
+
+class _Slot:
+    # Соединение в threading.local потока. Когда поток завершается, его
+    # локальные данные освобождаются вместе со слотом, и финализатор
+    # закрывает соединение
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class SQLiteEngine:
+    """Долгоживущие соединения SQLite для однонодового развёртывания.
+
+    Каждый поток держит своё соединение на запись и отдельное соединение
+    только для чтения; оба открываются один раз и живут, пока жив поток.
+    База переводится в WAL, поэтому читатели не блокируют писателя, а
+    synchronous=NORMAL убирает fsync на каждом коммите (fsync остаётся на
+    checkpoint). После fork соединения открываются заново.
+    """
+
+    def __init__(self, path, busy_timeout=5000, synchronous='NORMAL', mmap_size=256 * 1024 * 1024,
+                 cache_size=-16000):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size  # отрицательное значение — в КиБ
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._conns = set()
+        self.opened = 0
+
+    def _open(self, readonly):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode = WAL")
+        cur.execute(f"PRAGMA synchronous = {self.synchronous}")
+        cur.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        cur.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        cur.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        cur.execute("PRAGMA temp_store = MEMORY")
+        if readonly:
+            cur.execute("PRAGMA query_only = ON")
+        cur.close()
+        with self._lock:
+            self._conns.add(conn)
+            self.opened += 1
+        return conn
+
+    def _discard(self, conn, pid):
+        # Финализатор слота: поток завершился. После fork соединение родителя
+        # не закрываем — оно его, а не наше
+        if pid != os.getpid():
+            return
+        with self._lock:
+            self._conns.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def connection(self, readonly=False):
+        if self._pid != os.getpid():
+            # Соединения родителя в дочернем процессе не используем и не закрываем
+            self._reset()
+        attr = 'reader' if readonly else 'writer'
+        slot = getattr(self._local, attr, None)
+        if slot is None:
+            slot = _Slot(self._open(readonly))
+            weakref.finalize(slot, self._discard, slot.conn, os.getpid())
+            setattr(self._local, attr, slot)
+        return slot.conn
+
+    def release(self, conn):
+        # Соединение остаётся открытым; брошенная транзакция откатывается
+        if conn.in_transaction:
+            conn.rollback()
+
+    def closeall(self):
+        with self._lock:
+            conns, self._conns = self._conns, set()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'connections': len(self._conns), 'opened': self.opened}
@@ -0,0 +1,155 @@
+let currentArticleId = null;
+function setReadButton(isRead) {
+    const btn = document.getElementById('markReadBtn');
+    if(isRead) {
+        btn.disabled = true; 
+        btn.innerText = '✓ Уже прочитано'; 
+        btn.style.background = '#444';
+    } else {
+        btn.disabled = false; 
+        btn.innerText = 'Отметить прочитанным (+10 XP)'; 
+        btn.style.background = 'var(--accent)';
+    }
+}
+async function openArticle(id, isRead) {
+    currentArticleId = id;
+    document.getElementById('modalTitle').innerText = '';
+    document.getElementById('modalMeta').innerText = '';
+    document.getElementById('modalText').innerText = 'Загрузка...';
+    setReadButton(isRead);
+    document.getElementById('articleModal').classList.add('open');
+    const res = await fetch('/api/article/' + id);
+    if(!res.ok || currentArticleId !== id) return;
+    const art = await res.json();
+    document.getElementById('modalTitle').innerText = art.title;
+    document.getElementById('modalMeta').innerText = '⏱ ' + art.read_time;
+    document.getElementById('modalText').innerText = art.content;
+}
+function closeModal() { 
+    document.getElementById('articleModal').classList.remove('open'); 
+}
+// Ответы API несут новое состояние игрока: страница обновляется на месте,
+// без перезагрузки. Поля помечены в шаблонах атрибутом data-state
+function applyState(user) {
+    if(!user) return;
+    for(const el of document.querySelectorAll('[data-state]')) {
+        if(el.dataset.state in user) el.innerText = user[el.dataset.state];
+    }
+    // Кнопки магазина зависят от баланса
+    for(const box of document.querySelectorAll('[data-price]')) {
+        const btn = box.querySelector('button');
+        if(btn.hasAttribute('data-bought')) continue;
+        const enough = user.balance >= Number(box.dataset.price);
+        btn.disabled = !enough;
+        btn.innerText = enough ? 'Купить' : 'Нет 💰';
+        btn.style.background = enough ? '' : '#444';
+    }
+}
+async function refreshState() {
+    const res = await fetch('/api/me');
+    if(res.ok) applyState((await res.json()).user);
+}
+// Страница из кэша «назад/вперёд» могла устареть: подтягиваем только состояние
+window.addEventListener('pageshow', e => { if(e.persisted) refreshState(); });
+function showArticleRead(id) {
+    // Карточки в списке и в результатах поиска
+    for(const card of document.querySelectorAll('[data-article="' + id + '"]')) {
+        card.onclick = () => openArticle(id, true);
+        const [icon, body] = card.children;
+        const status = body.lastElementChild.lastElementChild;
+        icon.innerText = '✅';
+        status.innerText = '✓ Прочитано';
+        status.style.color = 'var(--accent)';
+    }
+}
+async function markRead() {
+    if(!currentArticleId) return;
+    const id = currentArticleId;
+    const res = await fetch('/api/read/' + id, {method: 'POST'});
+    const data = await res.json();
+    if(!data.ok) return;
+    if(data.is_read) {
+        setReadButton(true);
+        showArticleRead(id);
+    }
+    applyState(data.user);
+    if(data.credited) {
+        const counter = document.querySelector('[data-state="read_count"]');
+        if(counter) counter.innerText = Number(counter.innerText) + 1;
+        alert('Статья прочитана! +10 XP, +5 монет'); 
+    }
+}
+async function buyItem(id) {
+    if(!confirm('Купить этот предмет?')) return;
+    const res = await fetch('/api/buy/' + id, {method: 'POST'});
+    const data = await res.json();
+    if(data.ok) { 
+        const btn = document.querySelector('[data-product="' + id + '"] button');
+        if(btn) {
+            btn.setAttribute('data-bought', '');
+            btn.disabled = true;
+            btn.innerText = 'Куплено';
+            btn.style.background = '';
+        }
+        applyState(data.user);
+        alert(data.msg || 'Покупка успешна!'); 
+    } else { 
+        alert('Ошибка: ' + (data.error || 'Недостаточно средств')); 
+    }
+}
+let searchTimer = null;
+let searchSeq = 0;
+function searchArticles(q, page) {
+    // Ввод не дёргает сервер на каждую букву: запрос уходит после паузы
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(q.trim(), page || 1), 250);
+}
+async function runSearch(q, page) {
+    const box = document.getElementById('searchResults');
+    const list = document.getElementById('libraryList');
+    const seq = ++searchSeq;
+    if(!q) {
+        box.style.display = 'none';
+        list.style.display = '';
+        return;
+    }
+    const res = await fetch('/api/search?q=' + encodeURIComponent(q) + '&page=' + page);
+    if(!res.ok || seq !== searchSeq) return;
+    const data = await res.json();
+    if(page === 1) box.innerHTML = '';
+    const more = document.getElementById('searchMore');
+    if(more) more.remove();
+    if(page === 1 && !data.results.length) {
+        box.innerHTML = '<div class="card-desc">Ничего не найдено</div>';
+    }
+    for(const art of data.results) box.appendChild(searchCard(art));
+    if(data.has_more) {
+        const btn = document.createElement('button');
+        btn.id = 'searchMore';
+        btn.className = 'btn';
+        btn.innerText = 'Ещё';
+        btn.onclick = () => runSearch(q, page + 1);
+        box.appendChild(btn);
+    }
+    box.style.display = '';
+    list.style.display = 'none';
+}
+function searchCard(art) {
+    // Тексты только через innerText: в них пользовательский контент
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.dataset.article = art.id;
+    card.style.cssText = 'flex-direction:row; align-items:center; gap:15px; padding:15px;';
+    card.onclick = () => openArticle(art.id, art.is_read);
+    card.innerHTML = '<div style="font-size:24px; width:40px; text-align:center;"></div>'
+        + '<div style="flex:1;"><div class="card-title" style="margin-bottom:4px; font-size:16px;"></div>'
+        + '<div class="card-desc" style="margin-bottom:0; font-size:13px;"></div>'
+        + '<div class="card-meta" style="border:none; padding:0; margin-top:6px;"><span></span><span></span></div></div>';
+    const [icon, body] = card.children;
+    icon.innerText = art.is_read ? '✅' : '📖';
+    body.children[0].innerText = art.title;
+    body.children[1].innerText = art.excerpt + '...';
+    body.children[2].children[0].innerText = art.category + ' · ' + art.read_time;
+    body.children[2].children[1].innerText = art.is_read ? '✓ Прочитано' : 'Читать →';
+    return card;
+}
@@ -0,0 +1,72 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+
+class TelegramAuth:
+    """Проверка initData Telegram Mini App.
+
+    Секретный ключ выводится из токена бота один раз. Недавно проверенные
+    строки initData хранятся в LRU, так что повторный запуск приложения не
+    пересчитывает HMAC. auth_date старше max_age отклоняется всегда,
+    в том числе при попадании в кэш.
+    """
+
+    def __init__(self, bot_token, max_age=86400, cache_size=1024):
+        # https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+        self._secret = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # initData -> (user, auth_date)
+
+    def _fresh(self, auth_date, now):
+        return self.max_age <= 0 or now - auth_date <= self.max_age
+
+    def verify(self, init_data, now=None):
+        """Возвращает словарь user из initData или None."""
+        if not init_data:
+            return None
+        now = time.time() if now is None else now
+
+        with self._lock:
+            hit = self._cache.get(init_data)
+            if hit is not None:
+                self._cache.move_to_end(init_data)
+        if hit is not None:
+            user, auth_date = hit
+            return user if self._fresh(auth_date, now) else None
+
+        fields = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
+        received = fields.pop('hash', '')
+        check_string = '\n'.join(f"{k}={fields[k]}" for k in sorted(fields))
+        expected = hmac.new(self._secret, check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, received):
+            return None
+
+        try:
+            auth_date = int(fields.get('auth_date', 0))
+            user = json.loads(fields.get('user', '{}'))
+        except ValueError:
+            return None
+        if not self._fresh(auth_date, now) or not isinstance(user, dict) or 'id' not in user:
+            return None
+
+        with self._lock:
+            self._cache[init_data] = (user, auth_date)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def sign(self, user, auth_date=None, **extra):
+        """Собирает подписанную строку initData (для бенчмарков и отладки)."""
+        fields = {'user': json.dumps(user, ensure_ascii=False, separators=(',', ':')),
+                  'auth_date': str(int(time.time() if auth_date is None else auth_date))}
+        fields.update({k: str(v) for k, v in extra.items()})
+        check_string = '\n'.join(f"{k}={fields[k]}" for k in sorted(fields))
+        fields['hash'] = hmac.new(self._secret, check_string.encode(), hashlib.sha256).hexdigest()
+        return urllib.parse.urlencode(fields)